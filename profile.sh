@@ -323,8 +323,10 @@ cmd_capture() {
   local timestamp=$(date +"%H%M")
   local stabilized
   if [ "${CMD_SIGNAL_PID:0:1}" == "-" ]; then
-    # We signalled the entire process group. Stabilize, pull and symbolicate
-    # each file in parallel
+    # We signalled the entire process group. Stabilize and pull each file in
+    # parallel, and then symbolicate them all at once, so that we only
+    # resolve the libraries which the processes share once.
+    local pulled_list=$(mktemp -t profile-pulled.XXXXXX)
     for pid in ${B2G_PIDS[*]}; do (
       PREFIX="     ${pid}"
       PREFIX="${PREFIX:$((${#PREFIX} - 5)):5}: "
@@ -335,7 +337,7 @@ cmd_capture() {
       else
         cmd_pull ${pid} "${B2G_COMMS[${pid}]}" ${timestamp}
         if [ ! -z "${CMD_PULL_LOCAL_FILENAME}" -a -s "${CMD_PULL_LOCAL_FILENAME}" ]; then
-          cmd_symbolicate "${CMD_PULL_LOCAL_FILENAME}"
+          echo "${CMD_PULL_LOCAL_FILENAME}" >> "${pulled_list}"
         else
           echo "${PREFIX}PULL FAILED for ${pid}" 1>&2
         fi
@@ -346,8 +348,13 @@ cmd_capture() {
     # stabilizing loop will delay for at least two seconds, so this has no
     # impact on the performance, it just makes the output look a big nicer.
     sleep 1
-    echo "Waiting for stabilize/pull/symbolicate to finish ..."
+    echo "Waiting for stabilize/pull to finish ..."
     wait
+    local pulled_files=$(cat "${pulled_list}")
+    rm -f "${pulled_list}"
+    if [ ! -z "${pulled_files}" ]; then
+      cmd_symbolicate ${pulled_files}
+    fi
     echo "Done"
   else
 
@@ -381,6 +388,7 @@ cmd_capture() {
 
     pids="${CMD_SIGNAL_PID}"
     profiles_count=0
+    profiles_to_symbolicate=""
     profiles_to_merge=""
     for pid in $pids; do
       echo "Stabilizing ${pid} ${B2G_COMMS[${pid}]} ..." 1>&2
@@ -390,12 +398,15 @@ cmd_capture() {
       else
         cmd_pull ${pid} "${B2G_COMMS[${pid}]}"
         if [ ! -z "${CMD_PULL_LOCAL_FILENAME}" -a -s "${CMD_PULL_LOCAL_FILENAME}" ]; then
-          cmd_symbolicate "${CMD_PULL_LOCAL_FILENAME}"
-          profiles_to_merge="$profiles_to_merge $CMD_SYMBOLICATE_PROFILE"
+          profiles_to_symbolicate="$profiles_to_symbolicate $CMD_PULL_LOCAL_FILENAME"
           let profiles_count=profiles_count+1
         fi
       fi
     done
+    if [ "$profiles_count" -gt 0 ]; then
+      cmd_symbolicate $profiles_to_symbolicate
+      profiles_to_merge="$CMD_SYMBOLICATE_PROFILE"
+    fi
     SPS_VIDEO_ARGS=
     if [ -n "$SPS_VIDEO_FILE" ]; then
       SPS_VIDEO_ARGS="--video=$SPS_VIDEO_LINK/$VIDEO_FILE"
@@ -670,20 +681,23 @@ cmd_stop() {
 
 ###########################################################################
 #
-# Add symbols to a captured profile using the libraries from our build
-# tree.
+# Add symbols to one or more captured profiles using the libraries from our
+# build tree. Symbolicating several profiles at once resolves the libraries
+# they share just once.
 #
-HELP_symbolicate="Add symbols to a captured profile"
+HELP_symbolicate="Add symbols to captured profiles"
 cmd_symbolicate() {
-  local profile_filename="$1"
-  if [ -z "${profile_filename}" ]; then
+  local profile_filename
+  if [ -z "$1" ]; then
     echo "${PREFIX}Expecting the filename containing the profile data"
     exit 1
   fi
-  if [ ! -f "${profile_filename}" ]; then
-    echo "${PREFIX}File ${profile_filename} doesn't exist"
-    exit 1
-  fi
+  for profile_filename in "$@"; do
+    if [ ! -f "${profile_filename}" ]; then
+      echo "${PREFIX}File ${profile_filename} doesn't exist"
+      exit 1
+    fi
+  done
 
   # Get some variables from the build system
   local var_profile="./.var.profile"
@@ -695,11 +709,18 @@ cmd_symbolicate() {
     exit 1
   fi
 
-  local sym_filename="${profile_filename%.*}.sym"
-  echo "${PREFIX}Adding symbols to ${profile_filename} and creating ${sym_filename} ..."
+  local sym_filename
+  local output_args=()
+  local sym_filenames=()
+  for profile_filename in "$@"; do
+    sym_filename="${profile_filename%.*}.sym"
+    echo "${PREFIX}Adding symbols to ${profile_filename} and creating ${sym_filename} ..."
+    output_args+=(-o "${sym_filename}")
+    sym_filenames+=("${sym_filename}")
+  done
   ./scripts/profile-symbolicate.py \
-    $BP_SYMBOLS -o "${sym_filename}" "${profile_filename}" > /dev/null
-  CMD_SYMBOLICATE_PROFILE="$sym_filename"
+    $BP_SYMBOLS "${output_args[@]}" "$@" > /dev/null
+  CMD_SYMBOLICATE_PROFILE="${sym_filenames[*]}"
 }
 
 ###########################################################################
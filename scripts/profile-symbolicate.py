@@ -1,7 +1,26 @@
 #!/usr/bin/env python
 
-import argparse, bisect, json, os, subprocess, sys
-import os.path, re, urllib2
+import argparse, bisect, httplib, json, multiprocessing, os, shutil, socket
+import sqlite3, subprocess, sys, os.path, Queue, re, threading, time, urlparse
+from array import array
+from multiprocessing.pool import ThreadPool
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+import include.cache_utils as cache_utils
+import include.lib_index as lib_index
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# We keep addresses in arrays of this type. Python 2's array module doesn't
+# have "Q", but "L" is 64 bits wide on 64-bit hosts.
+try:
+  array("Q")
+  ADDRESS_TYPECODE = "Q"
+except ValueError:
+  ADDRESS_TYPECODE = "L"
 
 gSpecialLibs = {
     # The [vectors] is a special section used for functions which can really
@@ -15,14 +34,52 @@ gSpecialLibs = {
     }
 }
 
-symbol_path_matcher = re.compile(r"^(.+) \[(.*)]$")
+# Indexes of the libraries on the host, keyed by (dir, exclude_dir).  See
+# Library.FindLibInTree.
+gHostLibIndexes = {}
+gPersistHostLibIndexes = True
+
+# The SymbolCache holding the symbols we resolved in earlier runs, or None if
+# we're not using one.
+gSymbolCache = None
+
+# Keyword arguments for SymbolapiClient, from the command line.
+gSymbolapiOptions = {}
+
+# The Breakpad symbol files we've read, keyed by (symbols path, library
+# basename, breakpadId). See BreakpadSymbolFile.Get.
+gBreakpadSymbolFiles = {}
 
 def fixupAddress(lib, address):
-  lib_address = int(address, 0) - lib.start + lib.offset
+  lib_address = address - lib.start + lib.offset
   return (lib_address & ~1) - 1
 
-def formatAddress(address):
-  return "0x{:X}".format(address)
+def ParseAddresses(strings):
+  """Parses a list of address strings ("0x...") in bulk, leaving out any
+  which aren't valid hex numbers."""
+  try:
+    return map(int, strings, [16] * len(strings))
+  except ValueError:
+    # Something which looked like an address wasn't one, so parse them one
+    # at a time instead.
+    addresses = []
+    for string in strings:
+      try:
+        addresses.append(int(string, 16))
+      except ValueError:
+        pass
+    return addresses
+
+def formatAddressKey(address):
+  """Formats an address the way the symbolication table wants it."""
+  return "0x%08x" % address
+
+def SortedUniqueAddresses(addresses):
+  """Sorts and deduplicates an iterable of addresses, in bulk. Returns a
+  compact array (a NumPy array, if we have NumPy)."""
+  if numpy is not None:
+    return numpy.unique(numpy.fromiter(addresses, dtype=numpy.uint64))
+  return array(ADDRESS_TYPECODE, sorted(set(addresses)))
 
 def get_tools_prefix():
   if "GECKO_TOOLS_PREFIX" in os.environ:
@@ -50,6 +107,10 @@ class Library:
     self.verbose = verbose
     self.host_name = None
     self.located = False
+    # The addresses in this library which appear in the profile, and a dict
+    # from the ones we've resolved to their symbols.
+    self.addresses = array(ADDRESS_TYPECODE)
+    self.addresses_sorted = True
     self.symbols = {}
     self.symbol_table = None
     self.symbol_table_addresses = None
@@ -57,18 +118,34 @@ class Library:
 
   def AddressToSymbol(self, address_str):
     """Attempts to convert an address into a symbol."""
-    return self.AddressesToSymbols([address_str])[0]
+    return self.AddressesToSymbols([int(address_str, 0)])[0]
+
+  def AddressesToSymbols(self, addresses):
+    """Converts multiple addresses into symbols, taking the ones we resolved
+    in earlier runs from the symbol cache."""
+    if gSymbolCache is None or not self.IsCacheable():
+      return self.ResolveAddressesToSymbols(addresses)
+    offsets = [self.RelativeAddress(address) for address in addresses]
+    cached = gSymbolCache.Lookup(self.SymbolBackend(), self.id, offsets)
+    missing = [address for address, offset in zip(addresses, offsets)
+               if offset not in cached]
+    resolved = {}
+    if missing:
+      resolved = dict(zip(missing, self.ResolveAddressesToSymbols(missing)))
+      self.StoreInSymbolCache(resolved)
+    return [cached[offset] if offset in cached else resolved[address]
+            for address, offset in zip(addresses, offsets)]
 
-  def AddressesToSymbols(self, addresses_strs):
-    """Converts multiple addresses into symbols."""
+  def ResolveAddressesToSymbols(self, addresses):
+    """Converts multiple addresses into symbols, without the symbol cache."""
     if not self.located:
       self.Locate()
     if self.symbol_table:
-      return self.LookupAddressesInSymbolTable(addresses_strs)
+      return self.LookupAddressesInSymbolTable(addresses)
     if not self.host_name:
       unknown = "Unknown (in " + self.target_name + ")"
-      return [unknown for i in range(len(addresses_strs))]
-    syms = self.LookupAddressesInBreakpad(addresses_strs)
+      return [unknown for i in range(len(addresses))]
+    syms = self.LookupAddressesInBreakpad(addresses)
     if syms is not None:
       return syms
     target_tools_prefix = get_tools_prefix()
@@ -76,10 +153,10 @@ class Library:
       target_tools_prefix = "arm-eabi-"
     args = [target_tools_prefix + "addr2line", "-C", "-f", "-e", self.host_name]
     nm_args = ["gecko/tools/profiler/nm-symbolicate.py", self.host_name]
-    for address_str in addresses_strs:
-      lib_address = int(address_str, 0) - self.start + self.offset
+    for address in addresses:
+      lib_address = address - self.start + self.offset
       if self.verbose:
-        print "Address %s maps to library '%s' offset 0x%08x" % (address_str, self.host_name, lib_address)
+        print "Address 0x%08x maps to library '%s' offset 0x%08x" % (address, self.host_name, lib_address)
       # Fix up addresses from stack frames; they're for the insn after
       # the call, which might be a different function thanks to inlining:
       adj_address = max(0, (lib_address & ~1) - 1)
@@ -103,14 +180,76 @@ class Library:
       syms_and_lines = subprocess.check_output(nm_args).split("\n")
 
     syms = []
-    for i in range(len(addresses_strs)):
+    for i in range(len(addresses)):
       syms.append(syms_and_lines[i*2] + " (in " + self.target_name + ")")
     return syms
 
   def AddUnresolvedAddress(self, address):
     """Stores an address into a set of addresses which will be translated into symbols later"""
-    # The output format wants the addresses as 0xAAAAAAAA, so we store the keys as strings
-    self.symbols["0x%08x" % address] = None
+    self.addresses.append(address)
+    self.addresses_sorted = False
+
+  def AddUnresolvedAddresses(self, addresses):
+    """Stores many addresses at once, like AddUnresolvedAddress. If addresses
+    is sorted and has no duplicates, and we have no addresses yet, we just
+    take it as it is."""
+    if not len(self.addresses) and isinstance(addresses, array):
+      self.addresses = addresses
+      return
+    self.addresses.extend(addresses)
+    self.addresses_sorted = False
+
+  def Addresses(self):
+    """Returns the sorted, deduplicated array of addresses stored by
+    AddUnresolvedAddress(es)."""
+    if not self.addresses_sorted:
+      self.addresses = array(ADDRESS_TYPECODE, sorted(set(self.addresses)))
+      self.addresses_sorted = True
+    return self.addresses
+
+  def RelativeAddress(self, address):
+    """Converts an address into an offset into the library's file."""
+    return address - self.start + self.offset
+
+  def SymbolBackend(self):
+    """Names the way we resolve this library's symbols, which decides how the
+    symbols look: "symbolapi", "breakpad" or "addr2line"."""
+    if not self.symbols_path:
+      return "addr2line"
+    if self.symbols_path.startswith('http'):
+      return "symbolapi"
+    return "breakpad"
+
+  def IsCacheable(self):
+    """Determines if we can keep this library's symbols in the symbol cache,
+    which we can if it has a breakpadId to identify the build by."""
+    return (self.target_name not in gSpecialLibs and bool(self.id) and
+            self.id.strip("0") != "")
+
+  def LookupSymbolCache(self):
+    """Fills in the symbols for our unresolved addresses that we resolved in
+    earlier runs. Returns the number of addresses we found."""
+    if gSymbolCache is None or not self.IsCacheable():
+      return 0
+    addresses = self.UnresolvedAddresses()
+    cached = gSymbolCache.Lookup(
+      self.SymbolBackend(), self.id,
+      [self.RelativeAddress(address) for address in addresses])
+    for address in addresses:
+      sym = cached.get(self.RelativeAddress(address))
+      if sym is not None:
+        self.symbols[address] = sym
+    return len(cached)
+
+  def StoreInSymbolCache(self, syms):
+    """Stores a dict of addresses to symbols in the symbol cache. We leave out
+    the addresses we failed to resolve, so that we try again next time, e.g.
+    with a better build."""
+    if gSymbolCache is None or not self.IsCacheable():
+      return
+    gSymbolCache.Store(self.SymbolBackend(), self.id, dict(
+      (self.RelativeAddress(address), sym) for address, sym in syms.items()
+      if sym and not sym.startswith(("??", "Unknown"))))
 
   def ContainsAddress(self, address):
     """Determines if the indicated address is contained in this library"""
@@ -123,11 +262,36 @@ class Library:
 
   def DumpSymbols(self):
     """Dumps out some information about the symbols in this library."""
-    for address_str in sorted(self.symbols.keys()):
-      print address_str, self.symbols[address_str]
+    for address in self.Addresses():
+      print formatAddressKey(address), self.symbols.get(address)
 
   def FindLibInTree(self, basename, dir, exclude_dir=None):
-    """Search a tree for a library and return the first one found"""
+    """Search a tree for a library and return the first one found, preferring
+    unstripped copies.
+
+    We index each tree the first time we search it, and save the index
+    between runs; after that, finding a library is a dictionary lookup. The
+    index only holds "*.so" files and files without an extension, so we fall
+    back to find(1) for other names, like "libfoo.so.1"."""
+    key = (dir, exclude_dir)
+    if key not in gHostLibIndexes:
+      gHostLibIndexes[key] = lib_index.LibraryIndex(
+        [dir], suffixes=(".so",), extensionless=True,
+        exclude_dirs=[exclude_dir] if exclude_dir else [],
+        persist=gPersistHostLibIndexes)
+    index = gHostLibIndexes[key]
+    if not index.covers(basename):
+      return self.FindFileInTree(basename, dir, exclude_dir)
+    fullnames = index.find(basename)
+    for fullname in fullnames:
+      if index.has_symbols(fullname):
+        return fullname
+    if fullnames:
+      return fullnames[0]
+    return None
+
+  def FindFileInTree(self, basename, dir, exclude_dir=None):
+    """Search a tree for a file with find(1) and return the first one found."""
     args = ["find", dir]
     if exclude_dir:
       args = args + ["!", "(", "-name", exclude_dir, "-prune", ")"]
@@ -210,57 +374,231 @@ class Library:
     """Looks up multiple addresses using the special symbol table."""
     syms = []
     for address in addresses:
-      syms.append(self.LookupAddressInSymbolTable(address))
+      syms.append(self.LookupAddressInSymbolTable(formatAddressKey(address)))
     return syms
 
   def LookupAddressesInBreakpad(self, addresses):
+    """Looks up multiple addresses in the library's Breakpad symbol file under
+    symbols_path. Returns None if we don't have a symbols_path."""
     if not self.symbols_path:
       return None
 
-    if "GECKO_PATH" in os.environ:
-      gecko_src_path = os.environ["GECKO_PATH"]
-    else:
-      gecko_src_path = "gecko"
-    sys.path.append(os.path.join(gecko_src_path, "tools", "rb"))
-    from fix_stack_using_bpsyms import fixSymbols
-
-    def fixSymbol(address):
-      addr = fixupAddress(self, address)
-      # the 'x' in '0x' must be lower case, all others must be upper case
-      addr_str =  formatAddress(addr)
-      libname = os.path.basename(self.host_name)
-      line = "[" + libname + " +" + addr_str + "]"
-      symbol = fixSymbols(line, self.symbols_path)
-      if symbol == line:
-        return "??"
-      if symbol[-1] == "\n":
-        symbol = symbol[:-1]
-      # Absolute source path ends up in a long string,
-      # take only the source file with line number.
-      # When the symbol is resolved with source path,
-      # the symbol format is:
-      #   <function-name> [<source-path>:<line>]
-      match = symbol_path_matcher.match(symbol)
-      if match:
-        symbol, source_path = match.group(1, 2)
-        source_file = os.path.basename(source_path)
-        symbol += " @ " + source_file
-      return symbol + " (in " + self.target_name + ")"
-
-    return map(lambda address: fixSymbol(address), addresses)
+    sym_file = BreakpadSymbolFile.Get(self.symbols_path,
+                                      os.path.basename(self.host_name), self.id)
+    if sym_file is None:
+      return ["??"] * len(addresses)
+    syms = sym_file.LookupAddresses(
+      [fixupAddress(self, address) for address in addresses])
+    suffix = " (in " + self.target_name + ")"
+    return [sym + suffix if sym is not None else "??" for sym in syms]
 
   def ResolveSymbols(self, progress=False):
     """Tries to convert all of the symbols into symbolic equivalents."""
-    if len(self.symbols) == 0:
-      return
-    addresses_strs = self.symbols.keys()
-    for i in range(0,len(addresses_strs), 256):
-      slice = addresses_strs[i:i+256]
+    for slice in self.UnresolvedAddressSlices():
       if progress:
         print "Resolving symbols for", self.target_name, len(slice), "addresses"
       syms = self.AddressesToSymbols(slice)
-      for j in range(len(syms)):
-        self.symbols[addresses_strs[i+j]] = syms[j]
+      self.symbols.update(zip(slice, syms))
+
+  def UnresolvedAddresses(self):
+    """Returns the addresses stored by AddUnresolvedAddress which we haven't
+    resolved yet."""
+    symbols = self.symbols
+    return [address for address in self.Addresses() if address not in symbols]
+
+  def UnresolvedAddressSlices(self, slice_size=256):
+    """Splits the unresolved addresses into lists of at most slice_size
+    addresses, each of which we resolve with one addr2line."""
+    addresses = self.UnresolvedAddresses()
+    return [addresses[i:i+slice_size]
+            for i in range(0, len(addresses), slice_size)]
+
+###############################################################################
+#
+# BreakpadSymbolFile class. Reads the symbols from a Breakpad .sym file.
+#
+###############################################################################
+
+class BreakpadSymbolFile:
+  """The functions and source lines in a Breakpad .sym file.
+
+  We read the FUNC, PUBLIC and line records once, into arrays sorted by
+  address, and then find each address with a bisect. A FUNC or line record
+  covers [address, address + size); a PUBLIC record covers everything up to
+  the next PUBLIC or FUNC record."""
+
+  def __init__(self, filename):
+    files = {}
+    func_starts = array(ADDRESS_TYPECODE)
+    func_ends = array(ADDRESS_TYPECODE)
+    func_names = []
+    line_starts = array(ADDRESS_TYPECODE)
+    line_ends = array(ADDRESS_TYPECODE)
+    line_numbers = array("l")
+    line_files = array("l")
+    public_starts = array(ADDRESS_TYPECODE)
+    public_names = []
+
+    with open(filename, "r") as f:
+      for line in f:
+        if line[0] in "0123456789abcdef":
+          # <address> <size> <line> <file number>
+          address, size, number, file_number = line.split()
+          address = int(address, 16)
+          line_starts.append(address)
+          line_ends.append(address + int(size, 16))
+          line_numbers.append(int(number))
+          line_files.append(int(file_number))
+        elif line.startswith("FUNC "):
+          # FUNC [m] <address> <size> <parameter size> <name>
+          fields = line[5:].rstrip("\r\n")
+          if fields.startswith("m "):
+            fields = fields[2:]
+          address, size, _, name = fields.split(" ", 3)
+          address = int(address, 16)
+          func_starts.append(address)
+          func_ends.append(address + int(size, 16))
+          func_names.append(name)
+        elif line.startswith("PUBLIC "):
+          # PUBLIC [m] <address> <parameter size> <name>
+          fields = line[7:].rstrip("\r\n")
+          if fields.startswith("m "):
+            fields = fields[2:]
+          address, _, name = fields.split(" ", 2)
+          public_starts.append(int(address, 16))
+          public_names.append(name)
+        elif line.startswith("FILE "):
+          # FILE <number> <name>
+          _, number, name = line.rstrip("\r\n").split(" ", 2)
+          files[int(number)] = self.SourceFileName(name)
+
+    # dump_syms writes the records in address order, but we don't rely on it.
+    (func_starts, func_ends, func_names) = self.SortByAddress(
+      func_starts, func_ends, func_names)
+    (line_starts, line_ends, line_numbers, line_files) = self.SortByAddress(
+      line_starts, line_ends, line_numbers, line_files)
+    (public_starts, public_names) = self.SortByAddress(
+      public_starts, public_names)
+
+    self.files = files
+    self.func_starts = func_starts
+    self.func_ends = func_ends
+    self.func_names = func_names
+    self.line_starts = line_starts
+    self.line_ends = line_ends
+    self.line_numbers = line_numbers
+    self.line_files = line_files
+    self.public_starts = public_starts
+    self.public_names = public_names
+
+  @staticmethod
+  def Get(symbols_path, basename, breakpad_id):
+    """Returns the BreakpadSymbolFile for a library, reading it the first time
+    someone asks for it, or None if there isn't one under symbols_path."""
+    key = (symbols_path, basename, breakpad_id)
+    if key not in gBreakpadSymbolFiles:
+      filename = BreakpadSymbolFile.Find(symbols_path, basename, breakpad_id)
+      gBreakpadSymbolFiles[key] = filename and BreakpadSymbolFile(filename)
+    return gBreakpadSymbolFiles[key]
+
+  @staticmethod
+  def Find(symbols_path, basename, breakpad_id):
+    """Finds a library's symbol file in a symbol store laid out like
+    <symbols_path>/<basename>/<breakpadId>/<basename>.sym. If there's no
+    directory for breakpad_id but there's only one build of the library, we
+    take that one."""
+    lib_dir = os.path.join(symbols_path, basename)
+    if breakpad_id and os.path.isdir(os.path.join(lib_dir, breakpad_id)):
+      build_dir = breakpad_id
+    else:
+      try:
+        build_dirs = os.listdir(lib_dir)
+      except OSError:
+        return None
+      if len(build_dirs) != 1:
+        return None
+      build_dir = build_dirs[0]
+    filename = os.path.join(lib_dir, build_dir, basename + ".sym")
+    if not os.path.isfile(filename):
+      return None
+    return filename
+
+  @staticmethod
+  def SourceFileName(name):
+    """Strips a source file's name down to its basename. Release builds
+    record the repository and revision too, as in
+    hg:hg.mozilla.org/mozilla-central:dom/base/nsDocument.cpp:0123456789ab."""
+    parts = name.split(":")
+    if len(parts) == 4 and parts[0] in ("hg", "git", "svn", "cvs", "s3"):
+      name = parts[2]
+    return os.path.basename(name)
+
+  @staticmethod
+  def SortByAddress(starts, *columns):
+    """Sorts parallel arrays of records by their start addresses, unless
+    they're sorted already."""
+    if all(starts[i] <= starts[i + 1] for i in xrange(len(starts) - 1)):
+      return (starts,) + columns
+    order = sorted(xrange(len(starts)), key=starts.__getitem__)
+    return tuple(type(column)(column.typecode, (column[i] for i in order))
+                 if isinstance(column, array) else [column[i] for i in order]
+                 for column in (starts,) + columns)
+
+  def LookupAddresses(self, addresses):
+    """Looks up multiple offsets into the library. Returns the symbol for
+    each, as "function @ file:line" where we know the line, or None if we
+    don't have a symbol for it.
+
+    The addresses are usually sorted, so we start each bisect where the last
+    one left off."""
+    func_starts = self.func_starts
+    line_starts = self.line_starts
+    public_starts = self.public_starts
+    syms = []
+    # Many addresses share a function and a line, so build each symbol once.
+    formatted = {}
+    func_lo = line_lo = public_lo = 0
+    last_address = -1
+    for address in addresses:
+      if address < last_address:
+        func_lo = line_lo = public_lo = 0
+      last_address = address
+
+      func = bisect.bisect_right(func_starts, address, func_lo) - 1
+      func_lo = max(func, 0)
+      if func >= 0 and address < self.func_ends[func]:
+        line = bisect.bisect_right(line_starts, address, line_lo) - 1
+        line_lo = max(line, 0)
+        if line < 0 or address >= self.line_ends[line]:
+          line = None
+        key = (func, line, None)
+      else:
+        public = bisect.bisect_right(public_starts, address, public_lo) - 1
+        public_lo = max(public, 0)
+        # The PUBLIC record only covers the address if there's no FUNC
+        # record in between.
+        if public < 0 or (func >= 0 and
+                          public_starts[public] < self.func_ends[func]):
+          syms.append(None)
+          continue
+        key = (None, None, public)
+
+      sym = formatted.get(key)
+      if sym is None:
+        sym = formatted[key] = self.FormatSymbol(*key)
+      syms.append(sym)
+    return syms
+
+  def FormatSymbol(self, func, line, public):
+    """Formats the symbol for the given indexes into our FUNC, line and
+    PUBLIC records."""
+    if func is None:
+      return self.public_names[public]
+    if line is None:
+      return self.func_names[func]
+    return "%s @ %s:%d" % (self.func_names[func],
+                           self.files.get(self.line_files[line], "??"),
+                           self.line_numbers[line])
 
 ###############################################################################
 #
@@ -269,17 +607,21 @@ class Library:
 ###############################################################################
 
 class Libraries:
-  def __init__(self, profile, verbose=False, symbols_path=None):
-    lib_dicts = json.loads(profile["libs"])
-    lib_dicts = sorted(lib_dicts, key=lambda lib: lib["start"])
-    self.libs = [Library(lib_dict, verbose=verbose,
-      symbols_path=symbols_path) for lib_dict in lib_dicts]
+  def __init__(self, profile, verbose=False, symbols_path=None, libs=None):
+    """Creates the libraries listed in the profile, or, if libs is given,
+    tracks those Library objects instead."""
+    if libs is None:
+      lib_dicts = json.loads(profile["libs"])
+      libs = [Library(lib_dict, verbose=verbose,
+        symbols_path=symbols_path) for lib_dict in lib_dicts]
+    self.libs = sorted(libs, key=lambda lib: lib.start)
     # Create a sorted list of just the start addresses so that we can use
     # bisect to lookup addresses
     self.libs_start = [lib.start for lib in self.libs]
     self.profile = profile
     self.last_lib = None
     self.symbols_path = symbols_path
+    self.verbose = verbose
 
   def Dump(self):
     """Dumps out some information about all of the libraries that we're tracking."""
@@ -307,11 +649,26 @@ class Libraries:
       self.last_lib = self.AddressToLib(address)
     return self.last_lib
 
-  def ResolveSymbols(self, progress=True):
-    """Tries to convert all of the symbols into symbolic equivalents."""
+  def ResolveSymbols(self, progress=True, jobs=1):
+    """Tries to convert all of the symbols into symbolic equivalents.
+
+    First we take whatever we can from the symbol cache. If jobs is more than
+    1, we run up to that many addr2line processes at once, each of which
+    resolves one slice of one library's addresses."""
+    if gSymbolCache is not None:
+      found = sum(lib.LookupSymbolCache() for lib in self.libs)
+      if progress:
+        total = sum(len(lib.Addresses()) for lib in self.libs)
+        print "Found", found, "of", total, "addresses in the symbol cache"
+
     if not self.symbols_path or not self.symbols_path.startswith('http'):
-      for lib in self.libs:
-        lib.ResolveSymbols(progress=progress)
+      if jobs <= 1 or self.symbols_path:
+        # Breakpad lookups run in-process, so there's nothing to gain from
+        # running them on several threads.
+        for lib in self.libs:
+          lib.ResolveSymbols(progress=progress)
+      else:
+        self.ResolveSymbolsInParallel(progress, jobs)
       return
 
     # We were given a url address as the symbols path,
@@ -319,48 +676,68 @@ class Libraries:
     addresses = []
     memory_map = []
     libs = []
-    index = 0
-    address_map = {}
 
     for lib in self.libs:
       # skip fake binaries
       if not lib.target_name.startswith("["):
+        unresolved = lib.UnresolvedAddresses()
+        if not unresolved:
+          continue
         libname = os.path.basename(lib.target_name)
         memory_map.append((libname, lib.id))
-        libs.append(lib)
-        for address in lib.symbols.keys():
-            adj_address = fixupAddress(lib, address)
-            address_map[adj_address] = address
-            addresses.append((index, adj_address))
-        index += 1
-
-    symbolication_request = {
-      "stacks": [addresses],
-      "memoryMap": memory_map,
-      "version": 3,
-      "symbolSources": ["B2G", "Firefox"]
-    }
+        libs.append((lib, unresolved))
+        index = len(memory_map) - 1
+        for address in unresolved:
+          addresses.append((index, fixupAddress(lib, address)))
 
-    request_data = json.dumps(symbolication_request)
+    client = SymbolapiClient(self.symbols_path, jobs=jobs, **gSymbolapiOptions)
+    syms = client.Symbolicate(memory_map, addresses, progress=progress)
 
-    headers = {
-      "Content-Type": "application/json",
-      "Content-Length": len(request_data),
-      "Connection": "close"
-    }
+    # The symbols come back in the same order as the addresses we sent.
+    i = 0
+    for lib, unresolved in libs:
+      resolved = {}
+      for address, sym in zip(unresolved, syms[i:i+len(unresolved)]):
+        if sym is not None:
+          lib.symbols[address] = sym
+          resolved[address] = sym
+      i += len(unresolved)
+      lib.StoreInSymbolCache(resolved)
+
+  def ResolveSymbolsInParallel(self, progress, jobs):
+    """Resolves each library's addresses on a pool of jobs threads."""
+    libs = [lib for lib in self.libs if lib.UnresolvedAddresses()]
+    # Locate the libraries up front, on this thread; Locate may exit if it
+    # can't find the object directories.
+    for lib in libs:
+      if not lib.located:
+        lib.Locate()
 
-    request = urllib2.Request(url=self.symbols_path, data=request_data, headers=headers)
-    r = urllib2.urlopen(request)
-    if r.getcode() != 200:
-      raise Exception("Bad request: " + str(r.status_code))
+    # Hand out the biggest libraries' slices first, so one big library
+    # doesn't end up running by itself at the end.
+    libs.sort(key=lambda lib: len(lib.UnresolvedAddresses()), reverse=True)
+    tasks = [(lib, slice) for lib in libs
+             for slice in lib.UnresolvedAddressSlices()]
+    print_lock = threading.Lock()
 
-    content = json.load(r)
+    def resolveSlice(task):
+      lib, slice = task
+      if progress:
+        with print_lock:
+          print "Resolving symbols for", lib.target_name, len(slice), "addresses"
+      return lib.AddressesToSymbols(slice)
 
-    for sym, address in zip(content[0], addresses):
-      index = address[0]
-      lib = libs[index]
-      original_address = address_map[address[1]]
-      lib.symbols[original_address] = sym
+    pool = ThreadPool(min(jobs, len(tasks)) or 1)
+    try:
+      results = pool.map(resolveSlice, tasks, chunksize=1)
+    finally:
+      pool.close()
+      pool.join()
+
+    # Merge the results on this thread, in the same order as the tasks, so
+    # the symbolication table doesn't depend on which thread finished first.
+    for (lib, slice), syms in zip(tasks, results):
+      lib.symbols.update(zip(slice, syms))
 
   def SearchUnresolvedAddresses(self, progress=False):
     """Search and build a set of unresolved addresses for each library."""
@@ -383,30 +760,507 @@ class Libraries:
                 last_location = location
 
     def getUnresolvedAddressesV3():
+      # Most addresses appear in the string tables of several threads, so we
+      # collect the distinct strings first, and parse each of them once.
+      strings = set()
       for thread in self.profile["threads"]:
-        for str in thread["stringTable"]:
-          if str[:2] == "0x":
-            try:
-              yield int(str, 0)
-            except ValueError:
-              continue
+        strings.update(thread["stringTable"])
+      return ParseAddresses([str for str in strings if str[:2] == "0x"])
 
+    start_time = time.time()
     if self.profile["meta"]["version"] >= 3:
       addresses = getUnresolvedAddressesV3()
     else:
       addresses = getUnresolvedAddressesV2()
-    for address in addresses:
-      lib = self.Lookup(address)
-      if lib:
-        lib.AddUnresolvedAddress(address)
+    self.AddUnresolvedAddresses(addresses)
+    if self.verbose:
+      elapsed = max(time.time() - start_time, 1e-6)
+      found = sum(len(lib.Addresses()) for lib in self.libs)
+      print "Found %d addresses in %.3f seconds (%d addresses/s)" % (
+        found, elapsed, found / elapsed)
+
+  def AddUnresolvedAddresses(self, addresses):
+    """Adds each of the addresses to the set of unresolved addresses of the
+    library it comes from.  Addresses outside every library are ignored.
+
+    Rather than looking up each address's library, we sort and deduplicate
+    the addresses in bulk, and then find where each library's addresses
+    start and end in the sorted addresses."""
+    addresses = SortedUniqueAddresses(addresses)
+    # Like AddressToLib, we give each address to the library with the
+    # greatest start at or below it, if that library contains it.
+    starts = [lib.start for lib in self.libs]
+    ends = [min(lib.end, next_start) for lib, next_start in
+            zip(self.libs, starts[1:] + [lib.end for lib in self.libs[-1:]])]
+    if numpy is not None:
+      los = numpy.searchsorted(addresses, starts).tolist()
+      his = numpy.searchsorted(addresses, ends).tolist()
+    else:
+      los = [bisect.bisect_left(addresses, start) for start in starts]
+      his = [bisect.bisect_left(addresses, end) for end in ends]
+    for lib, lo, hi in zip(self.libs, los, his):
+      if lo < hi:
+        if numpy is not None:
+          lib.AddUnresolvedAddresses(array(ADDRESS_TYPECODE, addresses[lo:hi].tolist()))
+        else:
+          lib.AddUnresolvedAddresses(addresses[lo:hi])
 
   def SymbolicationTable(self):
     """Create the union of all of the symbols from all of the libraries."""
     result = {}
     for lib in self.libs:
-      result.update(lib.symbols)
+      symbols = lib.symbols
+      for address in lib.Addresses():
+        result[formatAddressKey(address)] = symbols.get(address)
     return result
 
+###############################################################################
+#
+# SymbolCache class. Remembers the symbols we resolve between runs.
+#
+###############################################################################
+
+class SymbolCache:
+  """An on-disk cache of symbols, keyed by (backend, breakpadId, offset into
+  the library), which lives in the cache directory we share with
+  fix_b2g_stack.py. Since a breakpadId identifies a build of a library, the
+  symbols stay valid for as long as you profile the same build. We keep each
+  backend's symbols apart (see Library.SymbolBackend), because addr2line,
+  Breakpad symbol files and symbolapi format them differently.
+
+  When the cache grows past max_size bytes, we evict the symbols which we
+  used least recently. Call Close() when you're done, to write everything
+  out. Until then, we only read from the database: we keep the symbols we
+  store and the symbols we use in memory, and write them all out in one short
+  transaction in Close(), so that we don't hold up other runs sharing the
+  cache.
+
+  The constructor raises OSError or sqlite3.Error if we can't open the cache.
+  If the cache fails after that, we warn and carry on without it."""
+
+  def __init__(self, max_size=256*1024*1024, cache_dir=None):
+    self.filename = os.path.join(cache_dir or cache_utils.get_cache_dir(),
+                                 "profile-symbolicate.sqlite")
+    self.max_size = max_size
+    self.lock = threading.Lock()
+    self.now = int(time.time())
+    # We may use the cache from several threads; self.lock serializes them.
+    self.db = sqlite3.connect(self.filename, timeout=60, check_same_thread=False)
+    columns = [row[1] for row in self.db.execute("PRAGMA table_info(symbols)")]
+    if columns and "backend" not in columns:
+      # The cache predates the backend column, so we can't tell which
+      # backend its symbols came from.
+      self.db.execute("DROP TABLE symbols")
+    self.db.execute("""CREATE TABLE IF NOT EXISTS symbols (
+                         backend TEXT,
+                         breakpad_id TEXT,
+                         offset INTEGER,
+                         symbol TEXT,
+                         last_used INTEGER,
+                         PRIMARY KEY (backend, breakpad_id, offset))""")
+    self.db.execute("""CREATE INDEX IF NOT EXISTS symbols_last_used
+                       ON symbols (last_used)""")
+    self.db.commit()
+    # The symbols we've stored, and the offsets we've found in the database,
+    # keyed by (backend, breakpad_id). We write these out in Close().
+    self.stored = {}
+    self.used = {}
+
+  def Lookup(self, backend, breakpad_id, offsets):
+    """Returns a dict from each of the offsets that are in the cache to its
+    symbol."""
+    result = {}
+    key = (backend, breakpad_id)
+    with self.lock:
+      if self.db is None:
+        return result
+      stored = self.stored.get(key, {})
+      for offset in set(offsets):
+        if offset in stored:
+          result[offset] = stored[offset]
+      offsets = [offset for offset in set(offsets) if offset not in stored]
+      found = {}
+      try:
+        # SQLite limits the number of parameters in a query, so look the
+        # offsets up in batches.
+        for i in range(0, len(offsets), 500):
+          batch = offsets[i:i+500]
+          placeholders = ",".join("?" * len(batch))
+          found.update(self.db.execute(
+            "SELECT offset, symbol FROM symbols WHERE backend = ? AND breakpad_id = ? AND offset IN (%s)"
+            % placeholders, [backend, breakpad_id] + batch))
+      except sqlite3.Error as e:
+        self.Disable(e)
+        return result
+      self.used.setdefault(key, set()).update(found)
+      result.update(found)
+    return result
+
+  def Store(self, backend, breakpad_id, syms):
+    """Stores a dict from offsets to symbols."""
+    if not syms:
+      return
+    with self.lock:
+      if self.db is None:
+        return
+      self.stored.setdefault((backend, breakpad_id), {}).update(syms)
+
+  def Close(self):
+    """Writes out the symbols we stored and when we used the others, evicts
+    the least recently used symbols if we're over max_size, and closes the
+    cache."""
+    with self.lock:
+      if self.db is None:
+        return
+      try:
+        with cache_utils.FileLock(self.filename + ".lock"):
+          for (backend, breakpad_id), syms in self.stored.items():
+            self.db.executemany(
+              "INSERT OR REPLACE INTO symbols VALUES (?, ?, ?, ?, ?)",
+              [(backend, breakpad_id, offset, sym, self.now)
+               for offset, sym in syms.items()])
+          for (backend, breakpad_id), offsets in self.used.items():
+            self.db.executemany(
+              "UPDATE symbols SET last_used = ? WHERE backend = ? AND breakpad_id = ? AND offset = ?",
+              [(self.now, backend, breakpad_id, offset) for offset in offsets])
+          self.Evict()
+          self.db.commit()
+      except (sqlite3.Error, IOError, OSError) as e:
+        print >>sys.stderr, "Couldn't write the symbol cache:", e
+      self.db.close()
+      self.db = None
+
+  def Disable(self, error):
+    """Stops using the cache after an error. Call this with self.lock held."""
+    print >>sys.stderr, "Not using the symbol cache any more:", error
+    self.db.close()
+    self.db = None
+
+  def Evict(self):
+    page_size = self.db.execute("PRAGMA page_size").fetchone()[0]
+    page_count = self.db.execute("PRAGMA page_count").fetchone()[0]
+    free_pages = self.db.execute("PRAGMA freelist_count").fetchone()[0]
+    size = (page_count - free_pages) * page_size
+    if size <= self.max_size:
+      return
+    # Evict down to three quarters of max_size, so that we don't have to
+    # evict again on every run. We assume all symbols take about the same
+    # space. SQLite reuses the freed pages, so the file stops growing.
+    count = self.db.execute("SELECT COUNT(*) FROM symbols").fetchone()[0]
+    keep = int(count * self.max_size * 0.75 / size)
+    self.db.execute("""DELETE FROM symbols WHERE rowid IN
+                       (SELECT rowid FROM symbols ORDER BY last_used LIMIT ?)""",
+                    [count - keep])
+
+###############################################################################
+#
+# SymbolapiClient class. Talks to a symbolapi server, e.g. Mozilla's.
+#
+###############################################################################
+
+class SymbolapiError(Exception):
+  pass
+
+class SymbolapiRequestTooLarge(SymbolapiError):
+  pass
+
+class SymbolapiClient:
+  """Sends version 3 symbolication requests to the symbolapi server at url.
+
+  Rather than one giant request, we send batches of at most batch_size
+  addresses, up to jobs of them at once, over a pool of kept-alive
+  connections. We retry a batch which fails with a network error or a
+  server error up to retries times, backing off exponentially from backoff
+  seconds, and split a batch in two if the server says it's too large. If a
+  batch still fails, we leave its addresses unresolved, but keep the symbols
+  from the other batches."""
+
+  def __init__(self, url, jobs=4, batch_size=2048, retries=4, backoff=0.5,
+               timeout=60, symbol_sources=("B2G", "Firefox")):
+    parts = urlparse.urlsplit(url)
+    if parts.scheme == "https":
+      self.connection_class = httplib.HTTPSConnection
+    else:
+      self.connection_class = httplib.HTTPConnection
+    self.host = parts.netloc
+    self.path = parts.path or "/"
+    if parts.query:
+      self.path += "?" + parts.query
+    self.url = url
+    self.jobs = max(1, jobs)
+    self.batch_size = batch_size
+    self.retries = retries
+    self.backoff = backoff
+    self.timeout = timeout
+    self.symbol_sources = list(symbol_sources)
+    self.connections = Queue.Queue()
+    self.print_lock = threading.Lock()
+
+  def Symbolicate(self, memory_map, addresses, progress=False):
+    """memory_map is a list of (library name, breakpadId) tuples, and
+    addresses is a list of (index into memory_map, offset) tuples. Returns a
+    list holding the symbol for each address, or None for the addresses we
+    couldn't get a symbol for."""
+    batches = [addresses[i:i+self.batch_size]
+               for i in range(0, len(addresses), self.batch_size)]
+    if not batches:
+      return []
+    if progress:
+      print "Sending", len(addresses), "addresses to", self.url, "in", len(batches), "batches"
+
+    pool = ThreadPool(min(self.jobs, len(batches)))
+    try:
+      results = pool.map(lambda batch: self.SymbolicateBatch(memory_map, batch),
+                         batches, chunksize=1)
+    finally:
+      pool.close()
+      pool.join()
+      self.Close()
+
+    syms = []
+    for result in results:
+      syms.extend(result)
+    return syms
+
+  def SymbolicateBatch(self, memory_map, batch):
+    # Only send the part of the memory map that this batch refers to.
+    indexes = sorted(set(index for index, offset in batch))
+    batch_indexes = dict((index, i) for i, index in enumerate(indexes))
+    request = {
+      "stacks": [[[batch_indexes[index], offset] for index, offset in batch]],
+      "memoryMap": [list(memory_map[index]) for index in indexes],
+      "version": 3,
+      "symbolSources": self.symbol_sources
+    }
+    try:
+      content = self.Post(json.dumps(request))
+    except SymbolapiRequestTooLarge:
+      if len(batch) == 1:
+        self.Warn("the server rejected a request for one address as too large")
+        return [None]
+      half = len(batch) // 2
+      return (self.SymbolicateBatch(memory_map, batch[:half]) +
+              self.SymbolicateBatch(memory_map, batch[half:]))
+    except SymbolapiError as e:
+      self.Warn("giving up on %d addresses: %s" % (len(batch), e))
+      return [None] * len(batch)
+
+    try:
+      syms = content[0]
+    except (IndexError, KeyError, TypeError):
+      syms = None
+    if not isinstance(syms, list) or len(syms) != len(batch):
+      self.Warn("giving up on %d addresses: unexpected response" % len(batch))
+      return [None] * len(batch)
+    return syms
+
+  def Post(self, data):
+    """POSTs data, and returns the parsed JSON response."""
+    error = None
+    for attempt in range(self.retries + 1):
+      if attempt:
+        time.sleep(self.backoff * 2 ** (attempt - 1))
+      connection = self.GetConnection()
+      try:
+        connection.request("POST", self.path, data,
+                           {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        body = response.read()
+      except (httplib.HTTPException, socket.error) as e:
+        # The connection may be broken (e.g. the server closed it while it
+        # was idle), so don't reuse it.
+        connection.close()
+        error = "%s: %s" % (e.__class__.__name__, e)
+        continue
+      if response.status == 200:
+        try:
+          content = json.loads(body)
+        except ValueError:
+          # Most likely a truncated or garbled response; try again on a
+          # fresh connection.
+          connection.close()
+          error = "the response isn't JSON"
+          continue
+        self.ReleaseConnection(connection)
+        return content
+      self.ReleaseConnection(connection)
+      if response.status == 413:
+        raise SymbolapiRequestTooLarge()
+      error = "HTTP %d %s" % (response.status, response.reason)
+      if response.status != 429 and response.status < 500:
+        raise SymbolapiError(error)
+    raise SymbolapiError(error)
+
+  def GetConnection(self):
+    try:
+      return self.connections.get_nowait()
+    except Queue.Empty:
+      return self.connection_class(self.host, timeout=self.timeout)
+
+  def ReleaseConnection(self, connection):
+    self.connections.put(connection)
+
+  def Close(self):
+    while True:
+      try:
+        self.connections.get_nowait().close()
+      except Queue.Empty:
+        break
+
+  def Warn(self, message):
+    with self.print_lock:
+      print >>sys.stderr, "symbolapi:", message
+
+###############################################################################
+#
+# Symbolicating several profiles, e.g. one per process, at once.
+#
+###############################################################################
+
+def ResolveSymbolsForProfiles(all_libs, progress=True, jobs=1):
+  """Resolves the unresolved addresses of several profiles' Libraries.
+
+  The processes on a device map mostly the same libraries, though not
+  always at the same addresses. So we group the libraries by name and
+  breakpadId, and resolve each distinct address within a library once, for
+  all of the profiles."""
+  if len(all_libs) == 1:
+    all_libs[0].ResolveSymbols(progress=progress, jobs=jobs)
+    return
+
+  # For each group, a Library which stands in for all of the group's
+  # libraries. It's mapped where the group's first library is mapped, and
+  # we translate the other libraries' addresses into its address space.
+  shared = {}
+  translations = []
+  for libs in all_libs:
+    for lib in libs.libs:
+      if not len(lib.Addresses()):
+        continue
+      key = (os.path.basename(lib.target_name), lib.id)
+      if key not in shared:
+        shared[key] = Library({"start": lib.start, "end": lib.end,
+                               "offset": lib.offset, "name": lib.target_name,
+                               "breakpadId": lib.id},
+                              verbose=lib.verbose, symbols_path=lib.symbols_path)
+      shared_lib = shared[key]
+      delta = shared_lib.start - shared_lib.offset - lib.start + lib.offset
+      shared_lib.AddUnresolvedAddresses(address + delta for address in lib.Addresses())
+      translations.append((lib, shared_lib, delta))
+
+  Libraries(None, symbols_path=all_libs[0].symbols_path,
+            libs=shared.values()).ResolveSymbols(progress=progress, jobs=jobs)
+
+  for lib, shared_lib, delta in translations:
+    for address in lib.Addresses():
+      sym = shared_lib.symbols.get(address + delta)
+      if sym is not None:
+        lib.symbols[address] = sym
+
+###############################################################################
+#
+# Streaming. For big profiles, we avoid loading the whole profile into memory.
+#
+###############################################################################
+
+address_matcher = re.compile(r'"(0x[0-9a-fA-F]+)"')
+structure_matcher = re.compile(r'["{}\[\]]')
+string_matcher = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"')
+colon_matcher = re.compile(r'\s*(:?)\s*')
+
+def ScanProfile(filename, keys, chunk_size=1024*1024):
+  """Reads the profile in filename a chunk at a time, without parsing all of
+  it. Returns a tuple (values, addresses): values maps each of the top-level
+  keys that we found to its parsed value, and addresses is the set of
+  distinct address strings ("0x...") anywhere in the profile.
+
+  Gecko writes the libs before the threads, so we normally find all of the
+  keys in the first few chunks, and after that we only run address_matcher
+  over the rest of the profile."""
+  keys = set(keys)
+  values = {}
+  addresses = set()
+  decoder = json.JSONDecoder()
+  depth = 0
+  buf = ""
+  # The end of the previous chunk, so that we find addresses which straddle
+  # two chunks. An address we find twice only goes into the set once.
+  tail = ""
+  with open(filename, "rb") as f:
+    while True:
+      chunk = f.read(chunk_size)
+      at_eof = not chunk
+      text = tail + chunk
+      addresses.update(address_matcher.findall(text))
+      tail = text[-64:]
+
+      # Walk the structure of the JSON until we've found all of the keys.
+      # We stop whenever we need to see more of the profile to make sense of
+      # a token, and carry on from there with the next chunk.
+      buf += chunk
+      pos = 0
+      while keys:
+        match = structure_matcher.search(buf, pos)
+        if not match:
+          pos = len(buf)
+          break
+        char = match.group()
+        if char in "{[":
+          depth += 1
+          pos = match.end()
+          continue
+        if char in "}]":
+          depth -= 1
+          pos = match.end()
+          continue
+        string = string_matcher.match(buf, match.start())
+        if not string:
+          pos = match.start()
+          break
+        pos = string.end()
+        if depth != 1:
+          continue
+        colon = colon_matcher.match(buf, pos)
+        if colon.end() == len(buf) and not at_eof:
+          pos = match.start()
+          break
+        if not colon.group(1):
+          continue
+        key = json.loads(string.group())
+        if key not in keys:
+          continue
+        try:
+          value, end = decoder.raw_decode(buf, colon.end())
+        except ValueError:
+          if at_eof:
+            raise
+          pos = match.start()
+          break
+        if end == len(buf) and not at_eof:
+          # The value might be a number which continues in the next chunk.
+          pos = match.start()
+          break
+        values[key] = value
+        keys.discard(key)
+        pos = end
+      buf = buf[pos:] if keys else ""
+
+      if at_eof:
+        break
+  return values, addresses
+
+def WriteSymbolicatedProfile(profile_filename, sym_filename, symbolication_table):
+  """Writes the profile in profile_filename along with its symbolication
+  table, copying the profile's JSON into the output as it is rather than
+  encoding a parsed copy of it."""
+  with open(sym_filename, "wb") as out:
+    out.write('{"format": "profileJSONWithSymbolicationTable,1", "profileJSON": ')
+    with open(profile_filename, "rb") as profile_file:
+      shutil.copyfileobj(profile_file, out, 1024*1024)
+    out.write(', "symbolicationTable": ')
+    json.dump(symbolication_table, out)
+    out.write('}')
+
 ###############################################################################
 #
 # Main
@@ -415,17 +1269,44 @@ class Libraries:
 
 def main():
   parser = argparse.ArgumentParser(description="Symbolicate Gecko Profiler file")
-  parser.add_argument("filename", help="profile file from phone")
+  parser.add_argument("filenames", metavar="filename", nargs="+",
+                      help="profile file from phone. Give several (e.g. one per process) to resolve the libraries they share just once")
   parser.add_argument("--dump-libs", help="Dump library information", action="store_true")
   parser.add_argument("--dump-syms", help="Dump symbol information", action="store_true")
   parser.add_argument("--no-progress", help="Turn off progress messages", action="store_true")
   parser.add_argument("-l", "--lookup", help="lookup a single address")
-  parser.add_argument("-o", "--output", help="specify the name of the output file")
+  parser.add_argument("-o", "--output", action="append",
+                      help="specify the name of the output file. Give it once for each profile, in the same order")
   parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
   parser.add_argument("-s", "--symbols-path", metavar="symbols path", help="Path to symbols directory")
+  parser.add_argument("--no-lib-index-cache", help="Don't save the index of host libraries between runs", action="store_true")
+  parser.add_argument("--streaming", help="Don't load the whole profile into memory. Use this for big profiles.", action="store_true")
+  parser.add_argument("--no-symbol-cache", help="Don't use the cache of symbols resolved in earlier runs", action="store_true")
+  parser.add_argument("--symbol-cache-size", metavar="MB", type=int, default=256,
+                      help="Maximum size of the symbol cache (default: 256 MB)")
+  parser.add_argument("--symbolapi-batch-size", metavar="N", type=int, default=2048,
+                      help="Maximum number of addresses per symbolapi request (default: 2048)")
+  parser.add_argument("--symbolapi-retries", metavar="N", type=int, default=4,
+                      help="Number of times to retry a failed symbolapi request (default: 4)")
+  parser.add_argument("--symbolapi-timeout", metavar="SECONDS", type=float, default=60,
+                      help="Timeout for symbolapi requests (default: 60)")
+  parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(),
+                      help="Number of addr2line processes to run at once (default: number of CPUs)")
   args = parser.parse_args(sys.argv[1:])
+  if args.output and len(args.output) != len(args.filenames):
+    parser.error("expected one --output for each profile file")
   verbose = args.verbose
   progress = not args.no_progress
+  global gPersistHostLibIndexes, gSymbolCache
+  gPersistHostLibIndexes = not args.no_lib_index_cache
+  if not args.no_symbol_cache:
+    try:
+      gSymbolCache = SymbolCache(max_size=args.symbol_cache_size*1024*1024)
+    except (OSError, IOError, sqlite3.Error) as e:
+      print >>sys.stderr, "Not using the symbol cache:", e
+  gSymbolapiOptions.update(batch_size=args.symbolapi_batch_size,
+                           retries=args.symbolapi_retries,
+                           timeout=args.symbolapi_timeout)
 
   if not args.symbols_path:
     if "GECKO_OBJDIR" not in os.environ:
@@ -446,7 +1327,7 @@ def main():
 
 
   if verbose:
-    print "Filename =", args.filename
+    print "Filenames =", " ".join(args.filenames)
     print_var("GECKO_OBJDIR")
     if "GECKO_TOOLS_PREFIX" in os.environ:
       print_var("GECKO_TOOLS_PREFIX")
@@ -454,42 +1335,85 @@ def main():
       print_var("TARGET_TOOLS_PREFIX")
     print_var("PRODUCT_OUT")
 
-  # Read in the JSON file created by the profiler.
-  if progress:
-    print "Reading profiler file", args.filename, "..."
-  profile = json.load(open(args.filename, "rb"))
+  # Read in the JSON files created by the profiler. In streaming mode, we
+  # only keep the libs and the distinct addresses of each profile.
+  profiles = []
+  all_addresses = []
+  all_libs = []
+  for filename in args.filenames:
+    if args.streaming:
+      if progress:
+        print "Scanning profiler file", filename, "..."
+      start_time = time.time()
+      profile, addresses = ScanProfile(filename, ["libs"])
+      if verbose:
+        elapsed = max(time.time() - start_time, 1e-6)
+        size = os.path.getsize(filename) / (1024.0 * 1024.0)
+        print "Scanned %.1f MB in %.3f seconds (%.1f MB/s)" % (
+          size, elapsed, size / elapsed)
+      if "libs" not in profile:
+        print filename, "doesn't have any libs"
+        sys.exit(1)
+    else:
+      if progress:
+        print "Reading profiler file", filename, "..."
+      profile = json.load(open(filename, "rb"))
+      addresses = None
 
-  libs = Libraries(profile, verbose, args.symbols_path)
-  if args.dump_libs:
-    libs.Dump()
+    libs = Libraries(profile, verbose, args.symbols_path)
+    if args.dump_libs:
+      libs.Dump()
+    profiles.append(profile)
+    all_addresses.append(addresses)
+    all_libs.append(libs)
 
   if args.lookup:
     address_str = args.lookup
     address = int(address_str, 0)
-    lib = libs.Lookup(address)
-    if lib:
-      lib.Locate()
-      print("Address 0x%08x maps to symbol '%s'" % (address, lib.AddressToSymbol(address_str)))
-    else:
-      print("Address 0x%08x not found in a library" % address)
+    for filename, libs in zip(args.filenames, all_libs):
+      if len(args.filenames) > 1:
+        print filename + ":"
+      lib = libs.Lookup(address)
+      if lib:
+        lib.Locate()
+        print("Address 0x%08x maps to symbol '%s'" % (address, lib.AddressToSymbol(address_str)))
+      else:
+        print("Address 0x%08x not found in a library" % address)
   else:
-    libs.SearchUnresolvedAddresses(progress=progress)
-    libs.ResolveSymbols(progress=progress)
-    if args.dump_syms:
-      libs.DumpSymbols()
-    else:
-      sym_profile = {"format": "profileJSONWithSymbolicationTable,1",
-                     "profileJSON": profile,
-                     "symbolicationTable": libs.SymbolicationTable()}
+    for libs, addresses in zip(all_libs, all_addresses):
+      if args.streaming:
+        libs.AddUnresolvedAddresses(ParseAddresses(list(addresses)))
+      else:
+        libs.SearchUnresolvedAddresses(progress=progress)
+    ResolveSymbolsForProfiles(all_libs, progress=progress, jobs=args.jobs)
+
+    for i, (filename, profile, libs) in enumerate(zip(args.filenames, profiles, all_libs)):
+      if args.dump_syms:
+        libs.DumpSymbols()
+        continue
       if args.output:
-        sym_filename = args.output
+        sym_filename = args.output[i]
       else:
-        sym_filename = args.filename + ".syms"
+        sym_filename = filename + ".syms"
       if progress:
         print "Writing symbolicated results to", sym_filename, "..."
-      json.dump(sym_profile, open(sym_filename, "wb"))
-      if progress:
-        print "Done"
+      if args.streaming:
+        WriteSymbolicatedProfile(filename, sym_filename, libs.SymbolicationTable())
+      else:
+        sym_profile = {"format": "profileJSONWithSymbolicationTable,1",
+                       "profileJSON": profile,
+                       "symbolicationTable": libs.SymbolicationTable()}
+        json.dump(sym_profile, open(sym_filename, "wb"))
+    if progress and not args.dump_syms:
+      print "Done"
+
+  # Save the indexes of the host's libraries, along with what we learned
+  # about which ones are stripped, so the next run doesn't have to walk the
+  # trees again.
+  for index in gHostLibIndexes.values():
+    index.save()
+  if gSymbolCache is not None:
+    gSymbolCache.Close()
 
 if __name__ == "__main__":
   main()
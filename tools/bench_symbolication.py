@@ -0,0 +1,635 @@
+#!/usr/bin/env python
+
+"""Benchmarks for fix_b2g_stack.py's symbolication hot paths.
+
+These benchmarks don't need a device; they run over synthetic reports which
+we generate on the fly.
+
+  classify: Measure how many lines per second fix_b2g_stack can classify as
+  stack frames or not, with and without the substring prefilter that runs
+  before the frame regexes.  Use --size to run over a multi-GB report; we
+  never hold more than a small block of the report in memory.
+
+  suite: Build a couple of ELF libraries with the host's C++ compiler, then
+  generate DMD reports (text and JSON) and Gecko profiles (versions 2 and 3)
+  which point into those libraries, at each of the scales given by --scales.
+  We time fix_b2g_stacks_in_file over the DMD reports with a cold and then
+  a warm cache, and profile-symbolicate.py's SearchUnresolvedAddresses and
+  ResolveSymbols over the profiles, and write the results out as JSON, so
+  that you can compare runs over time.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import sys
+if sys.version_info < (2, 7):
+    # We need Python 2.7 because we import argparse.
+    print('This script requires Python 2.7.', file=sys.stderr)
+    sys.exit(1)
+
+import argparse
+import hashlib
+import imp
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from distutils.spawn import find_executable
+from os.path import dirname
+
+import fix_b2g_stack
+import include.elf_utils as elf_utils
+
+
+def parse_size(size):
+    """Parse a size like '64M' or '4G' into a number of bytes."""
+    match = re.match(r'^(\d+(?:\.\d+)?)([KMG]?)B?$', size.upper())
+    if not match:
+        raise argparse.ArgumentTypeError("Can't parse size %r" % size)
+    multiplier = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}[match.group(2)]
+    return int(float(match.group(1)) * multiplier)
+
+
+def dmd_text_record(i, num_records, size, frames):
+    """Return the lines of the i'th heap block record of a DMD text report.
+    frames is the record's allocation stack, a list of (lib, offset)
+    tuples."""
+    lines = [
+        '#-----------------------------------------------------------------\n',
+        '\n',
+        'Unreported {\n',
+        '  %d blocks in heap block record %d of %d\n' % (i % 7 + 1, i + 1, num_records),
+        '  %d bytes (%d requested / %d slop)\n' % (size, size - 8, 8),
+        '  Individual block sizes: %d\n' % size,
+        '  0.01%% of the heap (%.2f%% cumulative)\n' % (i / num_records * 100),
+        '  Allocated at {\n',
+    ]
+    for (j, (lib, offset)) in enumerate(frames):
+        lines.append('    #%02d: ???[%s +0x%x] 0x%x\n' %
+                     (j + 1, lib, offset, 0xb0000000 + offset))
+    lines.extend(['  }\n', '}\n', '\n'])
+    return lines
+
+
+def synthetic_dmd_text_block(num_records=2000, libs=('libxul.so', 'libc.so'),
+                             frames_per_stack=8, seed=0):
+    """Return a list of lines which look like a piece of a DMD text report.
+
+    Like a real report, most of the lines aren't stack frames, and the frames
+    which are there repeat a lot.
+
+    """
+    rng = random.Random(seed)
+    offsets = [rng.randrange(0x1000, 0x2000000) for _ in range(500)]
+    lines = []
+    for i in range(num_records):
+        frames = [(rng.choice(libs), rng.choice(offsets))
+                  for _ in range(frames_per_stack)]
+        lines.extend(dmd_text_record(i, num_records, rng.randrange(16, 65536),
+                                     frames))
+    return lines
+
+
+def iter_lines(block, total_bytes):
+    """Yield lines from block, over and over, until we've yielded about
+    total_bytes bytes."""
+    block_bytes = sum(len(line) for line in block)
+    for _ in range(max(1, int(round(total_bytes / block_bytes)))):
+        for line in block:
+            yield line
+
+
+def time_classifier(classify, block, total_bytes):
+    """Run classify over total_bytes worth of lines from block.  Return a
+    tuple (lines, frames, seconds)."""
+    lines = 0
+    frames = 0
+    start = time.time()
+    for line in iter_lines(block, total_bytes):
+        lines += 1
+        if classify(line) is not None:
+            frames += 1
+    return (lines, frames, time.time() - start)
+
+
+def bench_classify(args):
+    block = synthetic_dmd_text_block()
+    results = {}
+    for (name, classify) in [('regex only', fix_b2g_stack._match_frame),
+                             ('prefiltered', fix_b2g_stack._parse_frame)]:
+        (lines, frames, seconds) = time_classifier(classify, block, args.size)
+        results[name] = lines / seconds
+        print('%-12s %d lines (%d frames, %.1f MB) in %.2fs: %.0f lines/s' %
+              (name, lines, frames, args.size / 1e6, seconds, lines / seconds))
+    print('Speedup: %.2fx' % (results['prefiltered'] / results['regex only']))
+
+
+###############################################################################
+# The benchmark suite.
+###############################################################################
+
+_profile_symbolicate_path = os.path.join(dirname(__file__), '..', 'scripts',
+                                         'profile-symbolicate.py')
+
+
+class Fixture(object):
+    """A library which we built for the benchmark suite.
+
+    name is the library's basename and target_name is its path on the
+    (imaginary) device, where it's mapped at [start, end).  functions is a
+    list of (address, size, name) tuples for the functions in the library.
+
+    """
+    def __init__(self, path, target_name, start):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.target_name = target_name
+        self.start = start
+        self.end = start + (os.path.getsize(path) + 0xfff & ~0xfff)
+        with elf_utils.ElfFile(path) as elf:
+            self.functions = [f for f in elf.function_symbols() if f[1] > 0]
+            self.build_id = elf.build_id()
+
+    def lib_dict(self):
+        """Return the entry for this library in a profile's libs list."""
+        breakpad_id = hashlib.sha1(self.name.encode('utf-8')).hexdigest()
+        return {'start': self.start, 'end': self.end, 'offset': 0,
+                'name': self.target_name,
+                'breakpadId': breakpad_id[:32].upper() + '0'}
+
+
+def fixture_source(num_functions):
+    """Return the C++ source of a library with num_functions functions."""
+    lines = ['namespace bench {', '']
+    for i in range(num_functions):
+        lines.extend([
+            'int Function%d(int x) {' % i,
+            '  int y = x * %d;' % (i + 1),
+            '  for (int j = 0; j < x; j++)',
+            '    y ^= j << %d;' % (i % 17),
+            '  return y;',
+            '}',
+            '',
+        ])
+    lines.append('}  // namespace bench')
+    return '\n'.join(lines) + '\n'
+
+
+def build_fixture(src_dir, path, num_functions):
+    """Compile a library with num_functions functions (and debug info) into
+    path."""
+    src = os.path.join(src_dir, os.path.basename(path) + '.cpp')
+    with open(src, 'w') as f:
+        f.write(fixture_source(num_functions))
+    if not os.path.isdir(dirname(path)):
+        os.makedirs(dirname(path))
+    cxx = os.environ.get('CXX', 'c++')
+    subprocess.check_call([cxx, '-shared', '-fPIC', '-g', '-O1', '-o', path, src])
+
+
+def build_fixtures(tmp_dir, num_functions):
+    """Lay out a fake gecko objdir and gonk product directory under tmp_dir,
+    containing libraries we build with the host's C++ compiler, and a fake
+    toolchain directory containing the host's binutils.
+
+    Returns a tuple (layout, fixtures), where layout is a dict of the
+    directories we created.
+
+    """
+    product_out = os.path.join(tmp_dir, 'gonk', 'target', 'product', 'bench')
+    layout = {
+        'gecko_objdir': os.path.join(tmp_dir, 'gecko'),
+        'gonk_objdir': os.path.join(tmp_dir, 'gonk'),
+        'product_out': product_out,
+        'toolchain_dir': os.path.join(tmp_dir, 'toolchain'),
+        'toolchain_prefix': 'host-',
+    }
+    os.makedirs(os.path.join(product_out, 'system', 'lib'))
+    os.makedirs(layout['toolchain_dir'])
+    for tool in ('addr2line', 'c++filt', 'nm'):
+        tool_path = find_executable(tool)
+        if tool_path:
+            os.symlink(tool_path, os.path.join(layout['toolchain_dir'],
+                                               layout['toolchain_prefix'] + tool))
+
+    xul_path = os.path.join(layout['gecko_objdir'], 'toolkit', 'library',
+                            'libbenchxul.so')
+    libc_path = os.path.join(product_out, 'symbols', 'system', 'lib',
+                             'libbenchc.so')
+    src_dir = os.path.join(tmp_dir, 'src')
+    os.makedirs(src_dir)
+    build_fixture(src_dir, xul_path, num_functions)
+    build_fixture(src_dir, libc_path, max(1, num_functions // 4))
+
+    fixtures = [Fixture(xul_path, '/system/b2g/libbenchxul.so', 0x40000000),
+                Fixture(libc_path, '/system/lib/libbenchc.so', 0x50000000)]
+    return (layout, fixtures)
+
+
+def frame_pool(fixtures, num_frames, rng):
+    """Return a list of up to num_frames distinct (fixture, offset) tuples.
+
+    Like return addresses, each offset points into the middle of one of the
+    fixture's functions.  Most of the frames are in the first fixture, just
+    as most of the frames in a B2G report are in libxul.
+
+    """
+    limit = sum(size for fixture in fixtures for (_, size, _) in fixture.functions)
+    pool = set()
+    while len(pool) < min(num_frames, limit):
+        if len(fixtures) == 1 or rng.random() < 0.8:
+            fixture = fixtures[0]
+        else:
+            fixture = rng.choice(fixtures[1:])
+        (address, size, _) = rng.choice(fixture.functions)
+        pool.add((fixture, address + rng.randrange(size)))
+    return sorted(pool, key=lambda frame: (frame[0].name, frame[1]))
+
+
+def random_stacks(pool, num_stacks, rng):
+    """Return num_stacks stacks of frames from pool, innermost frame first.
+
+    Stacks share their outer frames with other stacks, as they do in real
+    reports, so the profiles' stack tables have some structure to them.
+
+    """
+    roots = [[rng.choice(pool) for _ in range(rng.randrange(2, 6))]
+             for _ in range(max(1, num_stacks // 50))]
+    stacks = []
+    for _ in range(num_stacks):
+        leaves = [rng.choice(pool) for _ in range(rng.randrange(2, 12))]
+        stacks.append(leaves + rng.choice(roots))
+    return stacks
+
+
+def write_dmd_text(path, stacks, num_records, rng):
+    """Write a DMD text report with num_records records to path.  Returns a
+    dict of counts describing the report."""
+    num_lines = 0
+    num_frames = 0
+    with open(path, 'w') as f:
+        for i in range(num_records):
+            frames = [(fixture.name, offset)
+                      for (fixture, offset) in rng.choice(stacks)]
+            lines = dmd_text_record(i, num_records, rng.randrange(16, 65536),
+                                    frames)
+            f.writelines(lines)
+            num_lines += len(lines)
+            num_frames += len(frames)
+    return {'bytes': os.path.getsize(path), 'lines': num_lines,
+            'frames': num_frames}
+
+
+def write_dmd_json(path, stacks, num_records, rng):
+    """Write a DMD report in JSON format with num_records records to path.
+    Returns a dict of counts describing the report."""
+    frame_ids = {}
+    frame_table = {}
+    trace_table = {}
+    block_list = []
+    for i in range(num_records):
+        trace_id = 'T%d' % rng.randrange(len(stacks))
+        if trace_id not in trace_table:
+            trace = []
+            for (fixture, offset) in stacks[int(trace_id[1:])]:
+                key = (fixture.name, offset)
+                if key not in frame_ids:
+                    frame_ids[key] = 'F%d' % len(frame_ids)
+                    frame_table[frame_ids[key]] = \
+                        '#00: ???[%s +0x%x]' % (fixture.name, offset)
+                trace.append(frame_ids[key])
+            trace_table[trace_id] = trace
+        block_list.append({'req': rng.randrange(16, 65536), 'alloc': trace_id})
+
+    report = {
+        'version': 5,
+        'invocation': {'dmdEnvVar': '1', 'mode': 'live'},
+        'blockList': block_list,
+        'traceTable': trace_table,
+        'frameTable': frame_table,
+    }
+    with open(path, 'w') as f:
+        json.dump(report, f, separators=(',', ':'))
+    return {'bytes': os.path.getsize(path), 'frames': len(frame_table)}
+
+
+def make_profile_v2(fixtures, stacks, num_samples, rng, num_threads=4):
+    """Return a version 2 Gecko profile with num_samples samples, and the
+    number of addresses in it."""
+    threads = []
+    num_addresses = 0
+    for t in range(num_threads):
+        samples = []
+        for time_ in range(num_samples // num_threads):
+            frames = [{'location': '(root)'}]
+            for (fixture, offset) in reversed(rng.choice(stacks)):
+                frames.append({'location': '0x%x' % (fixture.start + offset)})
+            num_addresses += len(frames) - 1
+            if rng.random() < 0.25:
+                frames.append({'location': 'onTick (app://system/js/clock.js:%d)'
+                               % rng.randrange(1, 500)})
+            samples.append({'frames': frames, 'time': time_,
+                            'responsiveness': 0})
+        threads.append({'name': 'Thread %d' % t, 'samples': samples})
+
+    profile = {
+        'meta': {'version': 2, 'interval': 1, 'stackwalk': 1, 'product': 'B2G'},
+        'libs': json.dumps([fixture.lib_dict() for fixture in fixtures]),
+        'threads': threads,
+    }
+    return (profile, num_addresses)
+
+
+def make_profile_v3(fixtures, stacks, num_samples, rng, num_threads=4):
+    """Return a version 3 Gecko profile with num_samples samples, and the
+    number of addresses in it.
+
+    Version 3 profiles deduplicate each thread's frames and stacks into
+    tables, and keep each distinct string once in the thread's string table.
+
+    """
+    threads = []
+    num_addresses = 0
+    for t in range(num_threads):
+        string_table = []
+        string_ids = {}
+        frame_ids = {}
+        stack_ids = {}
+        frame_data = []
+        stack_data = []
+        sample_data = []
+
+        def intern(location):
+            if location not in string_ids:
+                string_ids[location] = len(string_table)
+                string_table.append(location)
+            if location not in frame_ids:
+                frame_ids[location] = len(frame_data)
+                frame_data.append([string_ids[location]])
+            return frame_ids[location]
+
+        for time_ in range(num_samples // num_threads):
+            stack_id = None
+            frames = [intern('(root)')]
+            for (fixture, offset) in reversed(rng.choice(stacks)):
+                frames.append(intern('0x%x' % (fixture.start + offset)))
+            for frame in frames:
+                if (stack_id, frame) not in stack_ids:
+                    stack_ids[(stack_id, frame)] = len(stack_data)
+                    stack_data.append([stack_id, frame])
+                stack_id = stack_ids[(stack_id, frame)]
+            sample_data.append([stack_id, time_, 0])
+
+        num_addresses += sum(1 for s in string_table if s.startswith('0x'))
+        threads.append({
+            'name': 'Thread %d' % t,
+            'samples': {'schema': {'stack': 0, 'time': 1, 'responsiveness': 2},
+                        'data': sample_data},
+            'stackTable': {'schema': {'prefix': 0, 'frame': 1},
+                           'data': stack_data},
+            'frameTable': {'schema': {'location': 0}, 'data': frame_data},
+            'stringTable': string_table,
+        })
+
+    profile = {
+        'meta': {'version': 3, 'interval': 1, 'stackwalk': 1, 'product': 'B2G'},
+        'libs': json.dumps([fixture.lib_dict() for fixture in fixtures]),
+        'threads': threads,
+    }
+    return (profile, num_addresses)
+
+
+def load_profile_symbolicate():
+    """Import scripts/profile-symbolicate.py, whose name isn't a valid module
+    name, without leaving a .pyc file behind in the source tree."""
+    dont_write_bytecode = sys.dont_write_bytecode
+    sys.dont_write_bytecode = True
+    try:
+        return imp.load_source('profile_symbolicate', _profile_symbolicate_path)
+    finally:
+        sys.dont_write_bytecode = dont_write_bytecode
+
+
+def make_result(benchmark, input_name, scale, cache, seconds, counts):
+    """Return a result record for the suite's JSON output.  For each count
+    (e.g. lines, frames) we also report the count per second."""
+    result = {'benchmark': benchmark, 'input': input_name, 'scale': scale,
+              'cache': cache, 'seconds': seconds}
+    for (name, count) in counts.items():
+        result[name] = count
+        result[name + '_per_sec'] = count / seconds if seconds > 0 else None
+    return result
+
+
+def run_fix_b2g_stacks(args, layout, input_path, input_name, scale, counts):
+    """Run fix_b2g_stacks_in_file over input_path, first with an empty cache
+    and then args.warm_runs times with the cache that the first run left
+    behind.  Returns a list of results."""
+    cache_dir = tempfile.mkdtemp(dir=args.tmp_dir, prefix='cache-')
+    options = {
+        'gecko_objdir': layout['gecko_objdir'],
+        'gonk_objdir': layout['gonk_objdir'],
+        'product': 'bench',
+        'toolchain_dir': layout['toolchain_dir'],
+        'toolchain_prefix': layout['toolchain_prefix'],
+        'cache_dir': cache_dir,
+        'resolver': args.resolver,
+        'jobs': args.jobs,
+    }
+    results = []
+    for cache in ['cold'] + ['warm'] * args.warm_runs:
+        log('fix_b2g_stacks_in_file: %s, scale %d, %s cache' %
+            (input_name, scale, cache))
+        with open(input_path, 'r') as infile:
+            start = time.time()
+            fix_b2g_stack.fix_b2g_stacks_in_file(infile, open(os.devnull, 'w'),
+                                                 options)
+            seconds = time.time() - start
+        results.append(make_result('fix_b2g_stacks_in_file', input_name, scale,
+                                   cache, seconds, counts))
+    return results
+
+
+def run_profile_symbolicate(args, profile_symbolicate, profile, input_name,
+                            scale, num_addresses):
+    """Time Libraries.SearchUnresolvedAddresses and Libraries.ResolveSymbols
+    over profile, first with an empty cache directory and then args.warm_runs
+    times with the cache directory that the first run left behind.  Returns
+    a list of results."""
+    os.environ['B2G_SYMBOL_CACHE_DIR'] = \
+        tempfile.mkdtemp(dir=args.tmp_dir, prefix='cache-')
+    results = []
+    for (i, cache) in enumerate(['cold'] + ['warm'] * args.warm_runs):
+        log('profile-symbolicate: %s, scale %d, %s cache' %
+            (input_name, scale, cache))
+        # Start each run the way a new process would, loading the host
+        # library indexes and the symbol cache from the cache directory.
+        profile_symbolicate.gHostLibIndexes.clear()
+        profile_symbolicate.gSymbolCache = profile_symbolicate.SymbolCache()
+        libs = profile_symbolicate.Libraries(profile)
+
+        start = time.time()
+        libs.SearchUnresolvedAddresses(progress=False)
+        seconds = time.time() - start
+        unique_addresses = sum(len(lib.Addresses()) for lib in libs.libs)
+        if i == 0:
+            # Searching doesn't touch the cache, so there's no point in
+            # reporting it more than once.
+            results.append(make_result(
+                'Libraries.SearchUnresolvedAddresses', input_name, scale, None,
+                seconds, {'addresses': num_addresses}))
+
+        start = time.time()
+        libs.ResolveSymbols(progress=False)
+        seconds = time.time() - start
+        results.append(make_result('Libraries.ResolveSymbols', input_name,
+                                   scale, cache, seconds,
+                                   {'addresses': unique_addresses}))
+        for index in profile_symbolicate.gHostLibIndexes.values():
+            index.save()
+        profile_symbolicate.gSymbolCache.Close()
+        profile_symbolicate.gSymbolCache = None
+    return results
+
+
+def bench_suite(args):
+    args.tmp_dir = tempfile.mkdtemp(prefix='bench_symbolication-')
+    try:
+        return _bench_suite(args)
+    finally:
+        if args.keep_temp:
+            log('Leaving temporary files in %s' % args.tmp_dir)
+        else:
+            shutil.rmtree(args.tmp_dir, ignore_errors=True)
+
+
+def _bench_suite(args):
+    log('Building ELF fixtures in %s...' % args.tmp_dir)
+    try:
+        (layout, fixtures) = build_fixtures(args.tmp_dir, args.functions)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print("Couldn't build the ELF fixtures (%s).  Is $CXX set to a working "
+              "C++ compiler?" % e, file=sys.stderr)
+        sys.exit(1)
+
+    os.environ['GECKO_OBJDIR'] = layout['gecko_objdir']
+    os.environ['PRODUCT_OUT'] = layout['product_out']
+    os.environ['GECKO_TOOLS_PREFIX'] = \
+        os.path.join(layout['toolchain_dir'], layout['toolchain_prefix'])
+    profile_symbolicate = load_profile_symbolicate()
+
+    rng = random.Random(args.seed)
+    pool = frame_pool(fixtures, args.unique_frames, rng)
+    stacks = random_stacks(pool, max(1, args.unique_frames // 4), rng)
+
+    results = []
+    for scale in args.scales:
+        for (input_name, write, suffix) in [('dmd-text', write_dmd_text, '.txt'),
+                                            ('dmd-json', write_dmd_json, '.json')]:
+            input_path = os.path.join(args.tmp_dir, 'dmd-%d%s' % (scale, suffix))
+            counts = write(input_path, stacks, scale, rng)
+            results.extend(run_fix_b2g_stacks(args, layout, input_path,
+                                              input_name, scale, counts))
+            os.remove(input_path)
+
+        for (input_name, make_profile) in [('profile-v2', make_profile_v2),
+                                           ('profile-v3', make_profile_v3)]:
+            (profile, num_addresses) = make_profile(fixtures, stacks, scale, rng)
+            results.extend(run_profile_symbolicate(
+                args, profile_symbolicate, profile, input_name, scale,
+                num_addresses))
+
+    report = {
+        'suite': 'bench_symbolication',
+        'format_version': 1,
+        'timestamp': time.time(),
+        'host': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpus': multiprocessing.cpu_count(),
+        },
+        'config': {
+            'scales': args.scales,
+            'functions': args.functions,
+            'unique_frames': len(pool),
+            'warm_runs': args.warm_runs,
+            'resolver': args.resolver,
+            'jobs': args.jobs,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+        log('Wrote results to %s' % args.output)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+def log(message):
+    print(message, file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark')
+
+    classify_parser = subparsers.add_parser(
+        'classify', help='Benchmark the stack frame line classifier.')
+    classify_parser.add_argument(
+        '--size', type=parse_size, default=parse_size('64M'),
+        help='Size of the synthetic report, e.g. 64M or 4G (default: 64M).')
+    classify_parser.set_defaults(func=bench_classify)
+
+    suite_parser = subparsers.add_parser(
+        'suite', help='Run the whole benchmark suite and output JSON.')
+    suite_parser.add_argument(
+        '--scales', type=lambda s: [int(n) for n in s.split(',')],
+        default=[1000, 10000, 50000],
+        help='Comma-separated sizes of the inputs to generate, in DMD records '
+             'or profile samples (default: 1000,10000,50000).')
+    suite_parser.add_argument(
+        '--functions', type=int, default=2000,
+        help='Number of functions in the biggest ELF fixture (default: 2000).')
+    suite_parser.add_argument(
+        '--unique-frames', type=int, default=5000,
+        help='Number of distinct frames in the inputs (default: 5000).')
+    suite_parser.add_argument(
+        '--warm-runs', type=int, default=1,
+        help='Number of runs with a warm cache after each cold run '
+             '(default: 1).')
+    suite_parser.add_argument(
+        '--resolver', choices=sorted(fix_b2g_stack._resolvers),
+        help="fix_b2g_stack's resolver (default: fix_b2g_stack's default).")
+    suite_parser.add_argument(
+        '--jobs', '-j', type=int, metavar='N',
+        help="fix_b2g_stack's --jobs (default: the number of CPUs).")
+    suite_parser.add_argument(
+        '--seed', type=int, default=0,
+        help='Seed for generating the inputs (default: 0).')
+    suite_parser.add_argument(
+        '--output', '-o', metavar='FILE',
+        help='Write the results to FILE instead of to stdout.')
+    suite_parser.add_argument(
+        '--keep-temp', action='store_true',
+        help="Don't delete the fixtures and inputs when we're done.")
+    suite_parser.set_defaults(func=bench_suite)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
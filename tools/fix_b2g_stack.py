@@ -21,15 +21,22 @@ import re
 import subprocess
 import itertools
 import argparse
+import json
 import platform
 import textwrap
 import threading
-import cPickle as pickle
-import fcntl
+import multiprocessing
+import tempfile
+import sqlite3
 from os.path import dirname
 from collections import defaultdict
 from gzip import GzipFile
 
+import include.cache_utils as cache_utils
+import include.demangle_utils as demangle_utils
+import include.elf_utils as elf_utils
+import include.lib_index as lib_index
+
 
 def first(pred, itr):
     """Return the first element of itr which matches the predicate pred, or
@@ -64,14 +71,6 @@ def pump(dst, src):
     return p
 
 
-def _none_factory():
-    return None
-
-
-def _defaultdict_none_factory():
-    return defaultdict(_none_factory)
-
-
 class FixB2GStacksOptions(object):
     """Encapsulates arguments used in fix_b2g_stacks_in_file.
 
@@ -90,6 +89,20 @@ class FixB2GStacksOptions(object):
       * toolchain_dir: The directory in which the cross-toolchain binaries
         live.  Default:
         ../prebuilt/PLATFORM-x86/toolchain/arm-linux-android-eabi-4.4.x/bin
+        If we're using the native resolver and can't find a toolchain, we use
+        the host's binaries instead.
+
+      * resolver: How we translate lib+offsets into function and file names:
+        'addr2line' runs the cross-toolchain's addr2line, and 'native'
+        reads the libraries' ELF symbol tables and DWARF line tables
+        in-process.  Default: 'addr2line' if we can find a toolchain, and
+        'native' otherwise.
+
+      * demangler: How we demangle C++ symbols: 'native' demangles just the
+        symbols in our translated frames, in-process, and 'c++filt' pipes all
+        of our output through the toolchain's c++filt.  Default: 'native' if
+        the host's C++ runtime lets us demangle in-process, and 'c++filt'
+        otherwise.
 
       * gecko_objdir: The gecko object directory.  Default: ../objdir-gecko.
 
@@ -103,6 +116,20 @@ class FixB2GStacksOptions(object):
       * remove_cache: If true, delete fix_b2g_stack.py's persistent
         addr2line cache when we start running fix_b2g_stacks_in_file.
 
+      * cache_dir: The directory holding the persistent addr2line cache, which
+        may be shared between trees.  Default: $B2G_SYMBOL_CACHE_DIR or
+        ~/.cache/b2g-symbols.
+
+      * jobs: The maximum number of addr2line processes to run concurrently
+        for a single library.  If this is greater than 1, we read the input
+        in large chunks and resolve each chunk's unique frames in parallel.
+        Default: the number of CPUs on this machine.
+
+      * two_pass: If true, make two passes over the input.  The first pass
+        collects the unique frames in the whole input and resolves them in
+        large batches; the second pass rewrites the lines from the resulting
+        table.  Default: False.
+
     In addition, this class defines two additional properties on itself based
     on the parameters received in __init__.
 
@@ -118,7 +145,7 @@ class FixB2GStacksOptions(object):
             try:
                 if getattr(args, arg):
                     return getattr(args, arg)
-            except TypeError:
+            except (TypeError, AttributeError):
                 pass
 
             try:
@@ -135,8 +162,25 @@ class FixB2GStacksOptions(object):
             return default
 
         self.toolchain_prefix = get_arg('toolchain_prefix', 'arm-linux-androideabi-')
-        self.toolchain_dir = get_arg('toolchain_dir', self._guess_toolchain_dir)
+        self.resolver = get_arg('resolver')
+        if self.resolver == 'addr2line':
+            self.toolchain_dir = get_arg('toolchain_dir', self._guess_toolchain_dir)
+        else:
+            try:
+                self.toolchain_dir = get_arg('toolchain_dir',
+                                             self._guess_toolchain_dir)
+            except Exception:
+                self.toolchain_dir = None
+            if not self.resolver:
+                self.resolver = 'addr2line' if self.toolchain_dir else 'native'
+
+        self.demangler = get_arg('demangler')
+        if not self.demangler:
+            self.demangler = 'native' if demangle_utils.is_available() else 'c++filt'
         self.remove_cache = get_arg('remove_cache', False)
+        self.cache_dir = get_arg('cache_dir')
+        self.jobs = get_arg('jobs', multiprocessing.cpu_count)
+        self.two_pass = get_arg('two_pass', False)
 
         self.gecko_objdir = get_arg(
             'gecko_objdir', os.path.join(dirname(__file__), '../objdir-gecko'))
@@ -152,6 +196,10 @@ class FixB2GStacksOptions(object):
         self.lib_search_dirs = [self.gecko_objdir, product_dir]
 
     def cross_bin(self, bin_name):
+        if not self.toolchain_dir:
+            # We only get here with the native resolver; fall back to the
+            # host's binary.
+            return bin_name
         return os.path.join(self.toolchain_dir, self.toolchain_prefix + bin_name)
 
     @staticmethod
@@ -190,102 +238,155 @@ class FixB2GStacksOptions(object):
 
 
 class StackFixerCache():
-    """A cache for StackFixer which occasionally serializes itself to disk.
+    """A cache for StackFixer which is backed by an sqlite database on disk.
 
     This cache stores (lib, offset) --> string mappings, so we can avoid
-    calling addr2line.  After every so many puts, we write the cache out to
-    disk.
+    calling addr2line.  We look entries up in the database lazily, as we need
+    them, so opening the cache is cheap no matter how large it grows.  We
+    write our puts out to disk in batches.
 
     Please be kind and call flush() on this object when you're done with it.
     That gives us one last chance to write our cache out to disk.
 
-    When the cache is read in from disk, we check that the libraries' sizes,
-    mtimes, and ctimes haven't changed.  If they have, we throw out the cached
-    mappings.
-
-    In theory you can safely access this cache from multiple processes, because
-    we use fcntl locking on the cache file.  (We never block on acquiring a
-    lock on the cache file; if we can't immediately access the file, we simply
-    give up.) But note that I have not tested that this locking works as
-    intended.
+    Each library's mappings are keyed by the library's contents: its GNU
+    build-id and what debug info it has, or a hash of the whole file if it
+    doesn't have a build-id (see cache_utils.get_lib_key).  So rebuilding a library, or symbolicating the
+    same build from another checkout or machine which shares our cache
+    directory, doesn't throw the cached mappings away.  To avoid re-reading
+    libraries on every run, we remember each library path's key along with
+    the path's fingerprint (see _get_lib_metadata), and only recompute the key
+    when the fingerprint changes.
+
+    The database lives in cache_utils.get_cache_dir() by default, and it's
+    safe to access from multiple processes: every write happens while holding
+    a blocking lock on a file next to the database, so concurrent writers wait
+    their turn.  If we can't open the database at all, we carry on with an
+    in-memory cache.
 
     """
     def __init__(self, options):
+        self._cache_dir = options.cache_dir
         self._initialized = False
-        self._lib_lookups = None
-        self._lib_metadata = None
-        self._put_counter = 0
+        self._db = None
+        self._lock = None
+        self._lib_ids = {}
+        self._lib_lookups = defaultdict(dict)
+        self._pending_puts = []
 
-        # Write the cache file after this many puts.
+        # Write the cache after this many puts.
         self._write_cache_after_puts = 500
 
     def _ensure_initialized(self):
         if self._initialized:
             return
-        cache = self._read_cache_from_disk()
-        if cache:
-            self._lib_lookups = cache['lookups']
-            self._lib_metadata = cache['metadata']
-            self._validate_lib_metadata()
-        else:
-            self._lib_lookups = defaultdict(_defaultdict_none_factory)
-            self._lib_metadata = {}
         self._initialized = True
+        try:
+            filename = StackFixerCache.cache_filename(self._cache_dir)
+            self._lock = cache_utils.FileLock(filename + '.lock')
+            with self._lock:
+                self._db = sqlite3.connect(filename, timeout=60)
+                self._db.text_factory = str
+                self._db.executescript('''
+                    CREATE TABLE IF NOT EXISTS libs (
+                        lib_id INTEGER PRIMARY KEY,
+                        lib_key TEXT UNIQUE NOT NULL);
+                    CREATE TABLE IF NOT EXISTS lib_paths (
+                        lib_path TEXT PRIMARY KEY,
+                        fingerprint TEXT NOT NULL,
+                        lib_id INTEGER NOT NULL);
+                    CREATE TABLE IF NOT EXISTS lookups (
+                        lib_id INTEGER NOT NULL,
+                        offset INTEGER NOT NULL,
+                        result TEXT NOT NULL,
+                        PRIMARY KEY (lib_id, offset));
+                    ''')
+        except (sqlite3.Error, IOError, OSError):
+            self._db = None
 
     @staticmethod
-    def cache_filename():
+    def cache_filename(cache_dir=None):
         """Get the filename of our cache."""
-        return os.path.join(dirname(__file__), '.fix_b2g_stack.cache')
-
-    @staticmethod
-    def _read_cache_from_disk():
-        try:
-            with open(StackFixerCache.cache_filename(), 'rb') as cache_file:
-                try:
-                    fcntl.lockf(cache_file.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
-                    return pickle.load(cache_file)
-                finally:
-                    try:
-                        fcntl.lockf(cache_file.fileno(), fcntl.LOCK_UN)
-                    except IOError:
-                        pass
-        except (EOFError, IOError, pickle.PickleError) as e:
-            pass
-        return None
+        return os.path.join(cache_dir or cache_utils.get_cache_dir(),
+                            'fix_b2g_stack.sqlite')
 
     def flush(self):
-        if self._put_counter:
+        if self._pending_puts:
             self._write_cache_to_disk()
 
     def _write_cache_to_disk(self):
         try:
-            with open(StackFixerCache.cache_filename(), 'wb') as cache_file:
-                try:
-                    fcntl.lockf(cache_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-                    pickle.dump({'lookups': self._lib_lookups,
-                                 'metadata': self._lib_metadata},
-                                cache_file,
-                                pickle.HIGHEST_PROTOCOL)
-                    self._put_counter = 0
-                    return True
-                finally:
-                    try:
-                        fcntl.lockf(cache_file.fileno(), fcntl.LOCK_UN)
-                    except IOError:
-                        pass
-        except IOError, pickle.PickleError:
+            if self._db:
+                with self._lock:
+                    self._db.executemany(
+                        'INSERT OR REPLACE INTO lookups VALUES (?, ?, ?)',
+                        self._pending_puts)
+                    self._db.commit()
+                return True
+        except (sqlite3.Error, IOError):
             pass
+        finally:
+            # Drop the pending puts even if the write above fails; if this
+            # write failed, it's likely that our next write will fail too,
+            # and we don't want to waste our time writing and failing over and
+            # over again.
+            self._pending_puts = []
         return False
 
-    def _validate_lib_metadata(self):
-        for (lib_path, cached_metadata) in self._lib_metadata.items():
-            real_metadata = self._get_lib_metadata(lib_path)
-            if real_metadata != cached_metadata or not real_metadata:
-                self._lib_metadata[lib_path] = real_metadata
-                try:
-                    del self._lib_lookups[lib_path]
-                except KeyError:
-                    pass
+    def _get_lib_id(self, lib_path):
+        """Get the id of the section of the database which holds lib_path's
+        mappings, creating the section if necessary.
+
+        Returns None if lib_path's mappings aren't cached on disk.
+
+        """
+        try:
+            return self._lib_ids[lib_path]
+        except KeyError:
+            pass
+
+        lib_id = None
+        metadata = self._get_lib_metadata(lib_path) if lib_path else None
+        if self._db and metadata:
+            (abs_path, fingerprint) = (metadata[0], repr(metadata))
+            try:
+                row = self._db.execute(
+                    'SELECT fingerprint, lib_id FROM lib_paths WHERE lib_path = ?',
+                    (abs_path,)).fetchone()
+                if row and row[0] == fingerprint:
+                    lib_id = row[1]
+                else:
+                    lib_id = self._set_lib_key(abs_path, fingerprint,
+                                               row[1] if row else None)
+            except (sqlite3.Error, IOError):
+                lib_id = None
+
+        self._lib_ids[lib_path] = lib_id
+        return lib_id
+
+    def _set_lib_key(self, abs_path, fingerprint, old_lib_id):
+        """Compute the key for the library at abs_path and point abs_path at
+        the key's section of the database.  If abs_path used to point at a
+        section which no other path uses, delete that section."""
+        lib_key = cache_utils.get_lib_key(abs_path)
+        if not lib_key:
+            return None
+
+        with self._lock:
+            self._db.execute('INSERT OR IGNORE INTO libs (lib_key) VALUES (?)',
+                             (lib_key,))
+            (lib_id,) = self._db.execute(
+                'SELECT lib_id FROM libs WHERE lib_key = ?', (lib_key,)).fetchone()
+            self._db.execute('INSERT OR REPLACE INTO lib_paths VALUES (?, ?, ?)',
+                             (abs_path, fingerprint, lib_id))
+            if old_lib_id is not None and old_lib_id != lib_id and \
+               not self._db.execute('SELECT 1 FROM lib_paths WHERE lib_id = ?',
+                                    (old_lib_id,)).fetchone():
+                self._db.execute('DELETE FROM lookups WHERE lib_id = ?',
+                                 (old_lib_id,))
+                self._db.execute('DELETE FROM libs WHERE lib_id = ?',
+                                 (old_lib_id,))
+            self._db.commit()
+        return lib_id
 
     @staticmethod
     def _get_lib_metadata(lib_path):
@@ -298,24 +399,41 @@ class StackFixerCache():
 
     def get(self, lib_path, offset):
         self._ensure_initialized()
-        return self._lib_lookups[lib_path][offset]
+        lookups = self._lib_lookups[lib_path]
+        try:
+            return lookups[offset]
+        except KeyError:
+            pass
 
-    def put(self, lib_path, offset, result):
+        result = None
+        lib_id = self._get_lib_id(lib_path)
+        if lib_id is not None:
+            try:
+                row = self._db.execute(
+                    'SELECT result FROM lookups WHERE lib_id = ? AND offset = ?',
+                    (lib_id, offset)).fetchone()
+                if row:
+                    result = row[0]
+            except sqlite3.Error:
+                pass
+        lookups[offset] = result
+        return result
+
+    def put(self, lib_path, offset, result, persist=True):
+        """Cache result for (lib_path, offset).  Unless persist is true, we
+        only remember it for this run, and don't write it to disk."""
         self._ensure_initialized()
-        if lib_path not in self._lib_metadata:
-            self._lib_metadata[lib_path] = self._get_lib_metadata(lib_path)
         self._lib_lookups[lib_path][offset] = result
+        if not persist:
+            return
 
-        self._put_counter += 1
-        if self._put_counter == self._write_cache_after_puts:
+        lib_id = self._get_lib_id(lib_path)
+        if lib_id is None:
+            return
+        self._pending_puts.append((lib_id, offset, result))
+        if len(self._pending_puts) >= self._write_cache_after_puts:
             self._write_cache_to_disk()
 
-            # Reset the put counter even if the cache write above fails; if
-            # this write failed, it's likely that our next write will fail too,
-            # and we don't want to waste our time writing and failing over and
-            # over again.
-            self._put_counter = 0
-
     def get_maybe_set(self, lib_path, offset, result):
         """Get the addr2line result for (lib_path, offset).
 
@@ -323,18 +441,225 @@ class StackFixerCache():
         |result|, depending on whether |result| is callable.
 
         """
-        self._ensure_initialized()
-        if not self._lib_lookups[lib_path][offset]:
-            if callable(result):
-                self.put(lib_path, offset, result())
-            else:
-                self.put(lib_path, offset, result)
+        cached = self.get(lib_path, offset)
+        if cached:
+            return cached
+        if callable(result):
+            self.put(lib_path, offset, result())
+        else:
+            self.put(lib_path, offset, result)
         return self._lib_lookups[lib_path][offset]
 
 
+class Addr2LinePool(object):
+    """A pool of long-lived addr2line processes, several per library.
+
+    StackFixer._addr2line sends one address at a time to a single addr2line
+    process per library, so all of the work for a hot library like libxul.so
+    ends up on one process.  This pool instead keeps up to |jobs| addr2line
+    processes per library and resolves a batch of offsets by splitting it
+    across those processes and driving them all at once.
+
+    Please be kind and call close() once you're done with this object.
+
+    """
+
+    # Don't start another addr2line process for a library unless it will get
+    # at least this many lookups.
+    _min_lookups_per_proc = 64
+
+    def __init__(self, options, jobs):
+        self._options = options
+        self._jobs = max(1, jobs)
+        self._procs = defaultdict(list)
+
+    def resolve(self, lib_offsets):
+        """Run addr2line on many offsets at once.
+
+        lib_offsets maps a lib_path to a list of offsets into that lib.  We
+        return a dict mapping (lib_path, offset) to a (func, file_name) tuple,
+        as output by addr2line.  If addr2line fails for an offset, that offset
+        is missing from the result.
+
+        """
+        work = []
+        for lib_path, offsets in lib_offsets.items():
+            num_procs = min(self._jobs,
+                            max(1, len(offsets) // self._min_lookups_per_proc))
+            procs = self._get_procs(lib_path, num_procs)
+            for i, proc in enumerate(procs):
+                work.append((proc, lib_path, offsets[i::len(procs)]))
+
+        results = {}
+        threads = [threading.Thread(target=self._query, args=w + (results,))
+                   for w in work]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def close(self):
+        for procs in self._procs.values():
+            for proc in procs:
+                try:
+                    proc.stdin.close()
+                    proc.wait()
+                except (IOError, OSError):
+                    pass
+        self._procs.clear()
+
+    def _get_procs(self, lib_path, num_procs):
+        procs = self._procs[lib_path]
+        # Replace any processes which have died since the last batch.
+        procs[:] = [proc for proc in procs if proc.poll() is None]
+        while len(procs) < num_procs:
+            procs.append(subprocess.Popen(
+                [self._options.cross_bin('addr2line'), '-Cfe', lib_path],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE))
+        return procs[:num_procs]
+
+    def _query(self, proc, lib_path, offsets, results):
+        # Write the offsets on a separate thread; otherwise, with a large
+        # batch, addr2line can fill up its stdout pipe while we're still
+        # blocked writing to its stdin.
+        def write_offsets():
+            try:
+                proc.stdin.write(''.join('0x%x\n' % offset for offset in offsets))
+                proc.stdin.flush()
+            except IOError:
+                pass
+
+        writer = threading.Thread(target=write_offsets)
+        writer.start()
+        died = False
+        try:
+            for offset in offsets:
+                # As in StackFixer._addr2line, we get two lines per address.
+                func = proc.stdout.readline()
+                file_name = proc.stdout.readline()
+                if not file_name:
+                    died = True
+                    break
+                results[(lib_path, offset)] = \
+                    (func.strip(), os.path.normpath(file_name.strip()))
+        except IOError:
+            died = True
+        writer.join()
+
+        if died or proc.poll() is not None:
+            # addr2line died.  Forget about it, so that the next batch for
+            # this library starts a new one.
+            try:
+                self._procs[lib_path].remove(proc)
+            except ValueError:
+                pass
+
+
+class Addr2LineResolver(object):
+    """A symbol resolver which runs the cross-toolchain's addr2line.
+
+    A resolver translates offsets into a library into (func, file_name)
+    tuples, of the form addr2line -f prints: func is '??' and file_name is
+    '??:0' if the resolver can't find anything.  Resolvers implement
+
+      * resolve(lib_path, offset): Resolve one offset, or raise IOError.
+
+      * resolve_many(lib_offsets): Resolve many offsets at once.  See
+        Addr2LinePool.resolve for the argument and return value.
+
+      * close()
+
+    See also NativeResolver.
+
+    """
+
+    _addr2line_procs = {}
+
+    def __init__(self, options):
+        self._options = options
+        self._pool = Addr2LinePool(options, options.jobs)
+
+    def resolve(self, lib_path, offset):
+        if lib_path not in Addr2LineResolver._addr2line_procs:
+            Addr2LineResolver._addr2line_procs[lib_path] = subprocess.Popen(
+                [self._options.cross_bin('addr2line'), '-Cfe', lib_path],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        proc = Addr2LineResolver._addr2line_procs[lib_path]
+        proc.stdin.write('0x%x\n' % offset)
+        proc.stdin.flush()
+
+        # addr2line returns two lines for every address we give it.  The
+        # first line is of the form "foo()", and the second line is of the
+        # form "foo.cpp:123".
+        func = proc.stdout.readline().strip()
+        file_name = os.path.normpath(proc.stdout.readline().strip())
+        return (func, file_name)
+
+    def resolve_many(self, lib_offsets):
+        return self._pool.resolve(lib_offsets)
+
+    def close(self):
+        self._pool.close()
+
+
+class NativeResolver(object):
+    """A symbol resolver which reads each library's ELF symbol table and DWARF
+    line table in-process, so we don't need a cross-toolchain or any
+    subprocesses.  See Addr2LineResolver for the interface.
+
+    We index each library the first time we see it.  Unlike addr2line -C, we
+    return mangled function names; the c++filt stage in
+    fix_b2g_stacks_in_file demangles them.
+
+    """
+    def __init__(self, options):
+        self._indexes = {}
+
+    def resolve(self, lib_path, offset):
+        index = self._index(lib_path)
+        if not index:
+            raise IOError("Couldn't read %s" % lib_path)
+        return index.lookup(offset)
+
+    def resolve_many(self, lib_offsets):
+        results = {}
+        for (lib_path, offsets) in lib_offsets.items():
+            index = self._index(lib_path)
+            if not index:
+                continue
+            for offset in offsets:
+                results[(lib_path, offset)] = index.lookup(offset)
+        return results
+
+    def close(self):
+        self._indexes.clear()
+
+    def _index(self, lib_path):
+        if lib_path not in self._indexes:
+            try:
+                self._indexes[lib_path] = elf_utils.SymbolIndex(lib_path)
+            except (IOError, elf_utils.ElfError):
+                self._indexes[lib_path] = None
+        return self._indexes[lib_path]
+
+
+_resolvers = {
+    'addr2line': Addr2LineResolver,
+    'native': NativeResolver,
+}
+
+# The library indexes which prepare_shared_caches built, keyed by
+# (lib_search_dirs, cache_dir).  Processes forked after that (e.g. the
+# workers of a multiprocessing.Pool) inherit them, so they don't each have to
+# stat the whole tree again.
+_shared_lib_indexes = {}
+
+
 class StackFixer(object):
     """An object used for translating (lib, offset) tuples into function+file
-    names, using addr2line and a cache.
+    names, using a resolver (addr2line, by default) and a cache.
 
     Here and elsewhere we adopt the convention that |lib| is a library's
     basename (e.g. 'libxul.so'), while lib_path is a relative path from
@@ -346,12 +671,15 @@ class StackFixer(object):
 
     """
 
-    _addr2line_procs = {}
-
     def __init__(self, options):
-        self._lib_path_cache = defaultdict(list)
+        self._lib_index = None
+        self._lib_path_cache = {}
         self._cache = StackFixerCache(options)
         self._options = options
+        self._resolver = _resolvers[options.resolver](options)
+        self._demangler = None
+        if options.demangler == 'native':
+            self._demangler = demangle_utils.Demangler()
 
     def translate(self, fn_guess, lib, offset):
         """Translate the given offset (an integer) into the given library (e.g.
@@ -360,25 +688,80 @@ class StackFixer(object):
         fn_guess is a hint to make the output look nicer; we don't use
         it to look up lib+offsets.
 
+        If we're demangling in-process, we demangle the C++ symbols in the
+        result.
+
         """
         lib_path = self._find_lib(lib)
-        return self._cache.get_maybe_set(lib_path, offset,
-            lambda: self._addr2line(lib, offset, fn_guess))
+        fixed = self._cache.get_maybe_set(lib_path, offset,
+            lambda: self._resolve(lib, offset, fn_guess))
+        if self._demangler:
+            return self._demangler.demangle_all(fixed)
+        return fixed
+
+    def prefetch(self, frames):
+        """Resolve many frames at once and store the results in our cache, so
+        that subsequent translate() calls for these frames are cache hits.
+
+        frames is an iterable of (fn_guess, lib, offset) tuples, with the same
+        meanings as the arguments to translate().  We group the cache misses
+        by library and hand them to our resolver as one batch.
+
+        """
+        misses = defaultdict(dict)
+        for (fn_guess, lib, offset) in frames:
+            lib_path = self._find_lib(lib)
+            if not lib_path or offset in misses[lib_path] or \
+               self._cache.get(lib_path, offset):
+                continue
+            misses[lib_path][offset] = (lib, fn_guess)
+
+        lib_offsets = {lib_path: sorted(offsets)
+                       for (lib_path, offsets) in misses.items() if offsets}
+        if not lib_offsets:
+            return
+        results = self._resolver.resolve_many(lib_offsets)
+
+        for lib_path in lib_offsets:
+            for (offset, (lib, fn_guess)) in misses[lib_path].items():
+                result = results.get((lib_path, offset))
+                if result:
+                    (func, file_name) = result
+                    self._cache.put(lib_path, offset, self._format_addr2line(
+                        lib, offset, fn_guess, func, file_name))
+                else:
+                    # Don't save the failure, so that the next run tries this
+                    # offset again.
+                    self._cache.put(lib_path, offset,
+                                    '%s (addr2line exception)' %
+                                    self._fallback_str(lib, offset, fn_guess),
+                                    persist=False)
 
     def close(self):
+        self._resolver.close()
         self._cache.flush()
+        if self._lib_index:
+            self._lib_index.save()
 
-    def _init_lib_path_cache(self):
-        """Initialize self._lib_path_cache by walking all of the subdirectories
-        of self._options.lib_search_dirs and finding all the '*.so', 'b2g', and
-        'plugin-container' files therein.
+    def _init_lib_index(self):
+        """Initialize self._lib_index, our index of all the '*.so', 'b2g', and
+        'plugin-container' files under self._options.lib_search_dirs.
+
+        The index is saved between runs, and refreshing it only lists the
+        directories whose mtime has changed, so this is much faster than
+        walking the whole tree.  If prepare_shared_caches already built this
+        index, in this process or before forking it, we use that one.
 
         """
-        for root, _, files in itertools.chain(*[os.walk(dir) for dir in
-                                                self._options.lib_search_dirs]):
-            for f in files:
-                if f.endswith('.so') or f == 'b2g' or f == 'plugin-container':
-                    self._lib_path_cache[f].append(os.path.join(root, f))
+        key = (tuple(self._options.lib_search_dirs), self._options.cache_dir)
+        self._lib_index = _shared_lib_indexes.get(key)
+        if self._lib_index:
+            return
+        self._lib_index = lib_index.LibraryIndex(
+            self._options.lib_search_dirs,
+            suffixes=('.so',), names=('b2g', 'plugin-container'),
+            cache_dir=self._options.cache_dir)
+        self._lib_index.save()
 
     def _find_lib(self, lib):
         """Get a path to the given lib (e.g. 'libxul.so').
@@ -389,81 +772,61 @@ class StackFixer(object):
         If we can't find the lib, we return None.
 
         """
-        if not self._lib_path_cache:
-            self._init_lib_path_cache()
+        try:
+            return self._lib_path_cache[lib]
+        except KeyError:
+            pass
 
-        lib_paths = self._lib_path_cache[lib]
-        if not lib_paths:
-            return None
-        if len(lib_paths) == 1:
-            return lib_paths[0]
+        if not self._lib_index:
+            self._init_lib_index()
 
-        lib_path = first(self._lib_has_symbols, lib_paths)
-        if not lib_path:
-            lib_path = self._lib_path_cache[lib][0]
-        self._lib_path_cache[lib] = [lib_path]
+        lib_paths = self._lib_index.find(lib)
+        if not lib_paths:
+            lib_path = None
+        elif len(lib_paths) == 1:
+            lib_path = lib_paths[0]
+        else:
+            lib_path = first(self._lib_index.has_symbols, lib_paths) or lib_paths[0]
+        self._lib_path_cache[lib] = lib_path
         return lib_path
 
-    def _lib_has_symbols(self, lib_path):
-        """Check if the given lib_path has symbols.
-
-        We do this by running nm on the library.  If it's stripped, nm will not
-        output anything to stdout.
-
-        """
-        proc = subprocess.Popen(
-            [self._options.cross_bin('nm'), lib_path],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        try:
-            return not not proc.stdout.readline()
-        except IOError:
-            return False
-        finally:
-            proc.kill()
-
-    def _addr2line(self, lib, offset, fn_guess):
-        """Use addr2line to translate the given lib+offset.
+    def _resolve(self, lib, offset, fn_guess):
+        """Use our resolver to translate the given lib+offset.
 
-        If addr2line can't resolve a lib+offset, you may still have a guess as
-        to what function lives there.  (For example, NS_StackWalk is sometimes
-        able to resolve function names that addr2line can't.)  fn_guess should
-        be this guess, if you have one.
+        If the resolver can't resolve a lib+offset, you may still have a guess
+        as to what function lives there.  (For example, NS_StackWalk is
+        sometimes able to resolve function names that addr2line can't.)
+        fn_guess should be this guess, if you have one.
 
         """
-        def addr_str():
-            return '(%s+0x%x)' % (lib, offset)
-
-        def fallback_str():
-            _fn_guess = fn_guess + ' ' if fn_guess and fn_guess != '???' else ''
-            return '%s%s' % (_fn_guess, addr_str())
-
-        if lib not in StackFixer._addr2line_procs:
-            lib_path = self._find_lib(lib)
-            if not lib_path:
-                return "%s (can't find lib)" % fallback_str()
-            StackFixer._addr2line_procs[lib] = subprocess.Popen(
-                [self._options.cross_bin('addr2line'), '-Cfe', lib_path],
-                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        lib_path = self._find_lib(lib)
+        if not lib_path:
+            return "%s (can't find lib)" % \
+                self._fallback_str(lib, offset, fn_guess)
 
-        proc = StackFixer._addr2line_procs[lib]
         try:
-            proc.stdin.write('0x%x\n' % offset)
-            proc.stdin.flush()
-
-            # addr2line returns two lines for every address we give it.  The
-            # first line is of the form "foo()", and the second line is of the
-            # form "foo.cpp:123".
-            func = proc.stdout.readline().strip()
-            file_name = os.path.normpath(proc.stdout.readline().strip())
-            if func == '??' and file_name == '??:0':
-                # addr2line wasn't helpful here.
-                return '%s (no addr2line)' % fallback_str()
-            return '%s %s %s' % (func, file_name, addr_str())
+            (func, file_name) = self._resolver.resolve(lib_path, offset)
         except IOError as e:
             # If our addr2line process dies, don't try to restart it.  Just
             # leave it in a dead state and presumably every time we read/write
             # to/from it, we'll hit this case.
-            return '%s (addr2line exception)' % fallback_str()
+            return '%s (addr2line exception)' % \
+                self._fallback_str(lib, offset, fn_guess)
+        return self._format_addr2line(lib, offset, fn_guess, func, file_name)
+
+    @staticmethod
+    def _fallback_str(lib, offset, fn_guess):
+        _fn_guess = fn_guess + ' ' if fn_guess and fn_guess != '???' else ''
+        return '%s(%s+0x%x)' % (_fn_guess, lib, offset)
+
+    @staticmethod
+    def _format_addr2line(lib, offset, fn_guess, func, file_name):
+        """Format addr2line's output for the given lib+offset."""
+        if func == '??' and file_name == '??:0':
+            # addr2line wasn't helpful here.
+            return '%s (no addr2line)' % \
+                StackFixer._fallback_str(lib, offset, fn_guess)
+        return '%s %s (%s+0x%x)' % (func, file_name, lib, offset)
 
 
 # Matches lines produced by DMD before bug 1062709 landed.
@@ -483,26 +846,151 @@ old_line_re = re.compile(
 # landed.
 line_re = re.compile("^(.*#\d+: )(.+)\[(.+) \+(0x[0-9A-Fa-f]+)\](.*)$")
 
-def fixSymbols(line, fixer):
+def _parse_frame(line):
+    """Parse a stack frame line into a (before, fn, lib, offset, after) tuple,
+    where offset is an integer.  Return None if the line isn't a stack frame.
+
+    """
+    # Most lines in a DMD report aren't stack frames.  Both stack frame formats
+    # contain a '[' and a '+0x', and checking for those substrings is much
+    # cheaper than running the regexes, so only run the regexes on lines
+    # which pass this check.
+    if '+0x' not in line or '[' not in line:
+        return None
+    return _match_frame(line)
+
+
+def _match_frame(line):
+    """Like _parse_frame, but run the regexes on every line."""
     # Try parsing it as if it's the new stack frame format.
     result = line_re.match(line)
-    if result is not None:
-        (before, fn, lib, offset, after) = result.groups()
-        return before + fixer.translate(fn, lib, int(offset, 16)) + after + '\n'
+    if result is None:
+        # Try parsing it as if it's the old stack frame format.
+        result = old_line_re.match(line)
+    if result is None:
+        return None
+
+    (before, fn, lib, offset, after) = result.groups()
+    return (before, fn, lib, int(offset, 16), after)
+
+
+def fixSymbols(line, fixer):
+    frame = _parse_frame(line)
+    if frame is None:
+        return line
+
+    (before, fn, lib, offset, after) = frame
+    return before + fixer.translate(fn, lib, offset) + after + '\n'
+
 
-    # Try parsing it as if it's the old stack frame format.
-    result = old_line_re.match(line)
-    if result is not None:
-        (before, fn, lib, offset, after) = result.groups()
-        return before + fixer.translate(fn, lib, int(offset, 16)) + after + '\n'
+def _fix_stacks_in_chunks(infile, outfile, fixer, chunk_lines=100000):
+    """Like calling fixSymbols on each line of infile, except that we read
+    chunk_lines lines at a time and resolve each chunk's frames in parallel
+    with fixer.prefetch() before writing the chunk out in its original order.
 
-    return line
+    """
+    while True:
+        lines = list(itertools.islice(infile, chunk_lines))
+        if not lines:
+            break
+        frames = [_parse_frame(line) for line in lines]
+        fixer.prefetch((fn, lib, offset)
+                       for (_, fn, lib, offset, _) in itertools.ifilter(None, frames))
+        for (line, frame) in itertools.izip(lines, frames):
+            if frame is None:
+                outfile.write(line)
+            else:
+                (before, fn, lib, offset, after) = frame
+                outfile.write(before + fixer.translate(fn, lib, offset) + after + '\n')
+
+
+def _fix_stacks_in_two_passes(infile, outfile, fixer):
+    """Like calling fixSymbols on each line of infile, except that we first
+    scan all of infile for the set of unique frames, resolve them all in one
+    batch, and then rewrite infile's lines from the resulting table.
+
+    DMD reports repeat the same frames many thousands of times, so this keeps
+    us from waiting on addr2line more than once per unique frame.
+
+    If infile isn't seekable (e.g. it's stdin), we spool it to a temporary
+    file during the first pass so we can read it again.
+
+    """
+    try:
+        start = infile.tell()
+        spool = None
+    except (IOError, AttributeError):
+        spool = tempfile.TemporaryFile()
+
+    # Map (lib, offset) to the first fn_guess we see for that frame.
+    unique_frames = {}
+    for line in infile:
+        if spool:
+            spool.write(line)
+        frame = _parse_frame(line)
+        if frame is not None:
+            (_, fn, lib, offset, _) = frame
+            unique_frames.setdefault((lib, offset), fn)
+
+    fixer.prefetch((fn, lib, offset)
+                   for ((lib, offset), fn) in unique_frames.iteritems())
+    table = {(lib, offset): fixer.translate(fn, lib, offset)
+             for ((lib, offset), fn) in unique_frames.iteritems()}
+
+    if spool:
+        spool.seek(0)
+        infile = spool
+    else:
+        infile.seek(start)
+
+    for line in infile:
+        frame = _parse_frame(line)
+        if frame is None:
+            outfile.write(line)
+        else:
+            (before, _, lib, offset, after) = frame
+            outfile.write(before + table[(lib, offset)] + after + '\n')
+
+    if spool:
+        spool.close()
+
+
+def prepare_shared_caches(args={}, **kwargs):
+    """Get fix_b2g_stack's persistent state ready for several processes to
+    run fix_b2g_stacks_in_file at once with these args.
+
+    We delete the persistent addr2line cache if remove_cache is set (so the
+    processes you start afterwards shouldn't set it), and build the library
+    index once, here.  Processes which you fork afterwards (e.g. with a
+    multiprocessing.Pool) use this index rather than each refreshing it from
+    the tree.  They share the addr2line cache on disk.
+
+    """
+    if args and kwargs:
+        raise Exception("Can't pass args and kwargs to prepare_shared_caches.")
+    options = FixB2GStacksOptions(args if args else kwargs)
+    _remove_cache_if_requested(options)
+    fixer = StackFixer(options)
+    fixer._init_lib_index()
+    _shared_lib_indexes[(tuple(options.lib_search_dirs), options.cache_dir)] = \
+        fixer._lib_index
+
+
+def _remove_cache_if_requested(options):
+    if options.remove_cache:
+        try:
+            os.remove(StackFixerCache.cache_filename(options.cache_dir))
+        except Exception:
+            pass
 
 
 def fix_b2g_stacks_in_file(infile, outfile, args={}, **kwargs):
     """Read lines from infile and output those lines to outfile with their
     stack frames rewritten.
 
+    If infile is a DMD report in JSON format, we instead rewrite the frames
+    in the report's frame table and write out the whole report as JSON.
+
     infile and outfile may be a files or file-like objects.  For example, to
     read/write from strings, pass StringIO objects.
 
@@ -514,15 +1002,21 @@ def fix_b2g_stacks_in_file(infile, outfile, args={}, **kwargs):
     if args and kwargs:
         raise Exception("Can't pass args and kwargs to fix_b2g_stacks_in_file.")
     options = FixB2GStacksOptions(args if args else kwargs)
-
-    if options.remove_cache:
-        try:
-            os.remove(StackFixerCache.cache_filename())
-        except Exception:
-            pass
+    _remove_cache_if_requested(options)
 
     fixer = StackFixer(options)
 
+    if options.demangler == 'native':
+        # The fixer demangles its output itself, so we can write straight to
+        # outfile.  We close outfile when we're done, just as pump() does
+        # below.
+        try:
+            _fix_stacks(infile, outfile, fixer, options)
+        finally:
+            outfile.close()
+        fixer.close()
+        return
+
     # Filter our output through c++filt.  Pumping on a separate thread is
     # *much* faster than filtering line-by-line.
     #
@@ -534,14 +1028,118 @@ def fix_b2g_stacks_in_file(infile, outfile, args={}, **kwargs):
                                stdout=subprocess.PIPE)
     try:
         p = pump(outfile, cppfilt.stdout)
-        for line in infile:
-            cppfilt.stdin.write(fixSymbols(line, fixer))
+        _fix_stacks(infile, cppfilt.stdin, fixer, options)
     finally:
         cppfilt.stdin.close()
     p.join()
     fixer.close()
 
 
+def _sniff_dmd_json(infile):
+    """Check whether infile holds a DMD report in JSON format, rather than a
+    text report.
+
+    Returns a tuple (is_json, infile), where the new infile reads the whole
+    input from its beginning; use it instead of the original infile.
+
+    """
+    try:
+        start = infile.tell()
+        first_line = infile.readline()
+        infile.seek(start)
+    except (IOError, AttributeError):
+        # We can't seek on infile (e.g. it's stdin), so stitch the first line
+        # back onto the rest of it.
+        lines = iter(infile)
+        first_line = next(lines, '')
+        infile = itertools.chain([first_line], lines)
+    return (first_line.lstrip().startswith('{'), infile)
+
+
+def _parse_dmd_json_frame(desc):
+    """Split a frame description from a JSON DMD report's frame table (e.g.
+    '#00: ???[libxul.so +0x1234]') into a (before, fn, lib, offset, after)
+    tuple, like _parse_frame does for lines of text reports.  Return None if
+    desc isn't in that form.
+
+    Frame descriptions are always in the new stack frame format, so we can
+    pick them apart with a few string operations rather than running them
+    through the line regexes.
+
+    """
+    open_bracket = desc.rfind('[')
+    close_bracket = desc.find(']', open_bracket)
+    if open_bracket < 0 or close_bracket < 0:
+        return None
+    (lib, sep, offset) = desc[open_bracket + 1:close_bracket].rpartition(' +0x')
+    if not sep or not lib:
+        return None
+    try:
+        offset = int(offset, 16)
+    except ValueError:
+        return None
+
+    head = desc[:open_bracket]
+    colon = head.find(': ')
+    if head.startswith('#') and colon >= 0:
+        (before, fn) = (head[:colon + 2], head[colon + 2:])
+    else:
+        (before, fn) = ('', head)
+    return (before, fn, lib, offset, desc[close_bracket + 1:])
+
+
+def _fix_stacks_in_dmd_json(infile, outfile, fixer, buffer_size=1024 * 1024):
+    """Symbolicate a DMD report in JSON format.
+
+    A JSON report keeps its frames in a deduplicated frame table, which maps
+    frame ids to frame descriptions; the stack traces refer to frames by id.
+    So rather than looking at every line of the report, we symbolicate each
+    entry of the frame table exactly once, and then stream the report back
+    out.
+
+    """
+    report = json.loads(infile.read() if hasattr(infile, 'read') else
+                        ''.join(infile))
+    frame_table = report.get('frameTable', {})
+
+    frames = {}
+    for (frame_id, desc) in frame_table.iteritems():
+        frame = _parse_dmd_json_frame(desc)
+        if frame is not None:
+            frames[frame_id] = frame
+
+    fixer.prefetch((fn, lib, offset)
+                   for (_, fn, lib, offset, _) in frames.itervalues())
+    for (frame_id, (before, fn, lib, offset, after)) in frames.iteritems():
+        frame_table[frame_id] = before + fixer.translate(fn, lib, offset) + after
+
+    # iterencode yields lots of tiny strings, so batch them up before writing.
+    chunks = []
+    chunks_size = 0
+    for chunk in json.JSONEncoder(separators=(',', ':')).iterencode(report):
+        chunks.append(chunk)
+        chunks_size += len(chunk)
+        if chunks_size >= buffer_size:
+            outfile.write(''.join(chunks))
+            chunks = []
+            chunks_size = 0
+    chunks.append('\n')
+    outfile.write(''.join(chunks))
+
+
+def _fix_stacks(infile, outfile, fixer, options):
+    (is_json, infile) = _sniff_dmd_json(infile)
+    if is_json:
+        _fix_stacks_in_dmd_json(infile, outfile, fixer)
+    elif options.two_pass:
+        _fix_stacks_in_two_passes(infile, outfile, fixer)
+    elif options.jobs > 1:
+        _fix_stacks_in_chunks(infile, outfile, fixer)
+    else:
+        for line in infile:
+            outfile.write(fixSymbols(line, fixer))
+
+
 def add_argparse_arguments(parser):
     """Add arguments to an argparse parser which make the parser's result
     suitable for passing to fix_b2g_stacks_in_file.
@@ -566,6 +1164,29 @@ def add_argparse_arguments(parser):
                              'We try to detect this automatically.')
     parser.add_argument('--remove-cache', action='store_true',
                         help="Delete the persistent addr2line cache before running.")
+    parser.add_argument('--cache-dir', metavar='DIR',
+                        help='Directory for the persistent addr2line cache, which '
+                             'can be shared between trees (default: '
+                             '$B2G_SYMBOL_CACHE_DIR or ~/.cache/b2g-symbols).')
+    parser.add_argument('--resolver', choices=sorted(_resolvers),
+                        help='How to resolve symbols: with the toolchain\'s '
+                             'addr2line, or natively, by reading the libraries\' '
+                             'ELF and DWARF data in-process (default: addr2line '
+                             'if we can find a toolchain, otherwise native).')
+    parser.add_argument('--demangler', choices=['native', 'c++filt'],
+                        help='How to demangle C++ symbols: in-process, or by '
+                             'piping our output through the toolchain\'s c++filt '
+                             '(default: native, if the host\'s C++ runtime '
+                             'supports it).')
+    parser.add_argument('--jobs', '-j', metavar='N', type=int,
+                        help='Maximum number of addr2line processes to run per '
+                             'library (default: number of CPUs).  Pass 1 to '
+                             'resolve frames one at a time as they stream past.')
+    parser.add_argument('--two-pass', action='store_true',
+                        help='Scan the whole input for unique frames and resolve '
+                             'them in one batch before rewriting it.  Faster on '
+                             'large DMD reports, at the cost of reading the '
+                             'input twice.')
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -27,17 +27,21 @@ import os
 import re
 import textwrap
 import argparse
+import copy
+import itertools
 import json
+import multiprocessing
 import urllib
 import shutil
 import subprocess
 import tarfile
+import time
 import traceback
-from datetime import datetime
 from gzip import GzipFile
 
 import include.device_utils as utils
 import fix_b2g_stack
+import get_gc_cc_log
 
 
 def process_dmd_files(dmd_files, args):
@@ -109,43 +113,90 @@ def get_objdir_and_product(args):
         pass
 
 
+def get_dmd_outfile_name(dmd_file, proc_names):
+    """Get the name of the file we should write the processed version of the
+    given DMD file to."""
+    # Extract the PID (e.g. 111) and UNIX time (e.g. 9999999) and the file
+    # kind ('txt' or 'json', depending on the version) from the name
+    # of the dmd file (e.g. dmd-9999999-111.json.gz).
+    basename = os.path.basename(dmd_file)
+    dmd_filename_match = re.match(r'^dmd-(\d+)-(\d+).(txt|json)', basename)
+    if dmd_filename_match:
+        pid = int(dmd_filename_match.group(2))
+        kind = dmd_filename_match.group(3)
+        if pid in proc_names:
+            outfile_name = 'dmd-%s-%d.%s' % (proc_names[pid], pid, kind)
+        else:
+            outfile_name = 'dmd-%d.%s' % (pid, kind)
+    else:
+        outfile_name = 'processed-' + basename
+        if outfile_name.endswith(".gz"):
+            outfile_name = outfile_name[:-3]
+    return outfile_name
+
+
+def process_dmd_file(work):
+    """Run fix_b2g_stack.py on one DMD file.
+
+    work is a tuple (dmd_file, outfile_path, args); we take a single argument
+    so we can be used with Pool.imap.  Returns a tuple (dmd_file, size of
+    dmd_file in bytes, seconds taken).
+
+    """
+    (dmd_file, outfile_path, args) = work
+    start = time.time()
+    size = os.path.getsize(dmd_file)
+    with GzipFile(outfile_path + '.gz', 'w') if args.compress_dmd_logs else \
+            open(outfile_path, 'w') as outfile:
+        with GzipFile(dmd_file, 'r') as infile:
+            fix_b2g_stack.fix_b2g_stacks_in_file(infile, outfile, args)
+
+    if not args.keep_individual_reports:
+        os.remove(dmd_file)
+    return (dmd_file, size, time.time() - start)
+
+
 def process_dmd_files_impl(dmd_files, args):
     out_dir = os.path.dirname(dmd_files[0])
 
     proc_names, procrank = get_proc_names(out_dir)
     get_objdir_and_product(args)
 
-    for f in dmd_files:
-        # Extract the PID (e.g. 111) and UNIX time (e.g. 9999999) and the file
-        # kind ('txt' or 'json', depending on the version) from the name
-        # of the dmd file (e.g. dmd-9999999-111.json.gz).
-        basename = os.path.basename(f)
-        dmd_filename_match = re.match(r'^dmd-(\d+)-(\d+).(txt|json)', basename)
-        if dmd_filename_match:
-            creation_time = datetime.fromtimestamp(int(dmd_filename_match.group(1)))
-            pid = int(dmd_filename_match.group(2))
-            kind = dmd_filename_match.group(3)
-            if pid in proc_names:
-                proc_name = proc_names[pid]
-                outfile_name = 'dmd-%s-%d.%s' % (proc_name, pid, kind)
-            else:
-                proc_name = None
-                outfile_name = 'dmd-%d.%s' % (pid, kind)
-        else:
-            pid = None
-            creation_time = None
-            outfile_name = 'processed-' + basename
-            if outfile_name.endswith(".gz"):
-                outfile_name = outfile_name[:-3]
-
-        outfile_path = os.path.join(out_dir, outfile_name)
-        with GzipFile(outfile_path + '.gz', 'w') if args.compress_dmd_logs else \
-                open(outfile_path, 'w') as outfile:
-            with GzipFile(f, 'r') as infile:
-                fix_b2g_stack.fix_b2g_stacks_in_file(infile, outfile, args)
+    # Process the DMD files in parallel, one per process.  The processes share
+    # fix_b2g_stack's library index and addr2line cache, which we set up here
+    # before we start them; they inherit the index when the pool forks them.
+    # We split the addr2line jobs between them.
+    fix_b2g_stack.prepare_shared_caches(args)
+    cpus = args.jobs or multiprocessing.cpu_count()
+    num_workers = max(1, min(len(dmd_files), cpus))
+    worker_args = copy.copy(args)
+    worker_args.remove_cache = False
+    worker_args.jobs = max(1, cpus // num_workers)
+
+    work = [(f, os.path.join(out_dir, get_dmd_outfile_name(f, proc_names)),
+             worker_args) for f in dmd_files]
+    if num_workers > 1:
+        pool = multiprocessing.Pool(num_workers)
+        results = pool.imap_unordered(process_dmd_file, work)
+    else:
+        pool = None
+        results = itertools.imap(process_dmd_file, work)
 
-        if not args.keep_individual_reports:
-            os.remove(f)
+    start = time.time()
+    total_size = 0
+    try:
+        for (i, (f, size, elapsed)) in enumerate(results):
+            total_size += size
+            print('  [%d/%d] Processed %s (%.1f MB) in %.1fs.' %
+                  (i + 1, len(work), os.path.basename(f), size / 1e6, elapsed))
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    elapsed = time.time() - start
+    print('Processed %d DMD file(s) (%.1f MB compressed) in %.1fs (%.1f MB/s).' %
+          (len(work), total_size / 1e6, elapsed, total_size / 1e6 / max(elapsed, 1e-3)))
 
 
 def get_kgsl_files(out_dir):
@@ -292,7 +343,6 @@ def get_and_show_info(args):
 
     # Get GC/CC logs if necessary.
     if args.get_gc_cc_logs:
-        import get_gc_cc_log
         print('')
         print('Pulling GC/CC logs...')
         get_gc_cc_log.get_logs(args, out_dir=out_dir, get_procrank_etc=False)
@@ -379,6 +429,27 @@ def main():
         action='store_false', default=True,
         help='Do not compress the individual GC/CC logs.')
 
+    parser.add_argument(
+        '--compress-gc-cc-log-on-host',
+        dest='compress_gc_cc_logs_on_host',
+        action='store_true', default=False,
+        help=textwrap.dedent('''\
+            Pull the GC/CC logs uncompressed and compress them on this
+            machine, instead of compressing them before they're pulled.'''))
+
+    parser.add_argument(
+        '--gc-cc-log-compression-format',
+        dest='gc_cc_log_compression_format',
+        choices=sorted(get_gc_cc_log.compression_formats), default='gzip',
+        help='The format to compress the GC/CC logs in.  (Default: gzip)')
+
+    parser.add_argument(
+        '--gc-cc-log-compression-level', type=int,
+        dest='gc_cc_log_compression_level', metavar='LEVEL',
+        help=textwrap.dedent('''\
+            The level to compress the GC/CC logs at.  (Default: 9 for gzip, 6
+            for xz, 3 for zstd)'''))
+
     parser.add_argument('--no-kgsl-logs',
                         action='store_true',
                         default=False,
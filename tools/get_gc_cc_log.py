@@ -22,47 +22,157 @@ import re
 import argparse
 import textwrap
 import gzip
+import shutil
+import subprocess
+import time
+from distutils.spawn import find_executable
 from multiprocessing import Pool
 
 import include.device_utils as utils
 
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
 
-def gzip_compress(to_compress):
-    with open(to_compress, mode='rb') as f_in:
-        with gzip.open(to_compress + '.gz', mode='wb') as f_out:
-            f_out.writelines(f_in)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
-    os.remove(to_compress)
 
+# For each compression format: the extension we give compressed logs, the
+# default compression level, and the program we run to compress if we don't
+# have a Python module for the format.
+compression_formats = {
+    'gzip': ('.gz', 9, 'gzip'),
+    'xz': ('.xz', 6, 'xz'),
+    'zstd': ('.zst', 3, 'zstd'),
+}
 
-def compress_logs(log_filenames, out_dir):
-    print('Compressing logs...')
+# The logs are often tens of megabytes, so we read them in big blocks.  (Some
+# of their lines are huge, so we don't want to read them line by line.)
+_block_size = 1024 * 1024
 
-    # Compress in parallel.  While we're at it, we also strip off the
-    # long identifier from the filenames, if we can.  (The filename is
-    # something like gc-log.PID.IDENTIFIER.log, where the identifier is
-    # something like the number of seconds since the epoch when the log was
-    # triggered.)
-    to_compress = []
-    for f in log_filenames:
-        # Rename the log file if we can.
-        match = re.match(r'^([a-zA-Z-]+\.[0-9]+)\.[0-9]+.log$', f)
-        if match:
-            if not os.path.exists(os.path.join(out_dir, match.group(1))):
-                new_name = match.group(1) + '.log'
-                os.rename(os.path.join(out_dir, f),
-                          os.path.join(out_dir, new_name))
-                f = new_name
 
-        to_compress.append(os.path.join(out_dir, f))
+def compression_available(format):
+    """Check whether we can compress with the given format, either with a
+    Python module or with a program."""
+    if format == 'gzip' or (format == 'xz' and lzma) or \
+       (format == 'zstd' and zstandard):
+        return True
+    return find_executable(compression_formats[format][2]) is not None
 
-    # Start compressing.
-    pool = Pool()
-    pool.map(gzip_compress, to_compress)
-    pool.close()
+
+def compress_file(path, format='gzip', level=None):
+    """Compress the file at path into a file named like path plus the format's
+    extension, and remove the original.  Returns a tuple (size of the file,
+    size of the compressed file, seconds taken)."""
+    start = time.time()
+    (extension, default_level, program) = compression_formats[format]
+    if level is None:
+        level = default_level
+    out_path = path + extension
+
+    with open(path, 'rb') as f_in:
+        if format == 'gzip':
+            with gzip.GzipFile(out_path, 'wb', compresslevel=level) as f_out:
+                shutil.copyfileobj(f_in, f_out, _block_size)
+        elif format == 'xz' and lzma:
+            with lzma.LZMAFile(out_path, 'wb', preset=level) as f_out:
+                shutil.copyfileobj(f_in, f_out, _block_size)
+        elif format == 'zstd' and zstandard:
+            with open(out_path, 'wb') as f_out:
+                zstandard.ZstdCompressor(level=level).copy_stream(
+                    f_in, f_out, read_size=_block_size, write_size=_block_size)
+        else:
+            with open(out_path, 'wb') as f_out:
+                subprocess.check_call([program, '-%d' % level, '-c'],
+                                      stdin=f_in, stdout=f_out)
+
+    sizes = (os.path.getsize(path), os.path.getsize(out_path))
+    os.remove(path)
+    return sizes + (time.time() - start,)
+
+
+def compress_log(path, format='gzip', level=None):
+    """Compress one log, unless we compressed it while we pulled it (in which
+    case its name ends in .gz).  While we're at it, we also strip off the long
+    identifier from the filename, if we can.  (The filename is something like
+    gc-log.PID.IDENTIFIER.log, where the identifier is something like the
+    number of seconds since the epoch when the log was triggered.)
+
+    Returns compress_file's result, or None if we didn't compress the log."""
+    (out_dir, f) = os.path.split(path)
+
+    # Rename the log file if we can.
+    match = re.match(r'^([a-zA-Z-]+\.[0-9]+)\.[0-9]+.log(\.gz)?$', f)
+    if match:
+        if not os.path.exists(os.path.join(out_dir, match.group(1))):
+            new_name = match.group(1) + '.log' + (match.group(2) or '')
+            os.rename(path, os.path.join(out_dir, new_name))
+            path = os.path.join(out_dir, new_name)
+
+    if path.endswith('.gz'):
+        return None
+    return compress_file(path, format, level)
+
+
+class LogCompressor(object):
+    """Compresses logs on a pool of processes.
+
+    Call add() with each log as soon as it's ready (e.g. from
+    notify_and_pull_files's on_file_pulled, on the thread which pulled it),
+    and we start compressing it right away.  finish() waits until we've
+    compressed every log, reports how fast we compressed them, and shuts the
+    pool down.  If you have to stop early, call close() instead.
+
+    """
+
+    def __init__(self, format='gzip', level=None):
+        # Start the pool now, on the calling thread, rather than from
+        # whichever thread first calls add().
+        self._pool = Pool()
+        self._format = format
+        self._level = level
+        self._results = []
+
+    def add(self, path):
+        self._results.append(self._pool.apply_async(
+            compress_log, (path, self._format, self._level)))
+
+    def finish(self):
+        sizes = [result.get() for result in self._results]
+        self._results = []
+        self._pool.close()
+        self._pool.join()
+        sizes = [s for s in sizes if s]
+        if not sizes:
+            return
+        in_size = sum(s[0] for s in sizes)
+        out_size = sum(s[1] for s in sizes)
+        seconds = max(sum(s[2] for s in sizes), 1e-3)
+        print('Compressed %d log(s) from %.1f MB to %.1f MB with %s '
+              '(%.1f MB/s per process).' %
+              (len(sizes), in_size / 1e6, out_size / 1e6, self._format,
+               in_size / 1e6 / seconds))
+
+    def close(self):
+        """Stop compressing, without waiting for the logs we're still
+        compressing."""
+        self._pool.terminate()
+        self._pool.join()
 
 
 def get_logs(args, out_dir=None, get_procrank_etc=True):
+    format = args.gc_cc_log_compression_format
+    if args.compress_gc_cc_logs and not compression_available(format):
+        raise Exception("Can't compress logs with %s; install the %s program." %
+                        (format, compression_formats[format][2]))
+
     if not out_dir:
         if args.output_directory:
             out_dir = utils.create_specific_output_dir(args.output_directory)
@@ -75,17 +185,35 @@ def get_logs(args, out_dir=None, get_procrank_etc=True):
         fifo_msg='gc log'
 
     def do_work():
-        log_filenames = utils.notify_and_pull_files(
-            fifo_msg=fifo_msg,
-            outfiles_prefixes=['cc-edges.', 'gc-edges.'],
-            remove_outfiles_from_device=not args.leave_on_device,
-            out_dir=out_dir)
+        # Compress each log in parallel as soon as we've pulled it, while we
+        # pull the others.  We can only compress logs on their way to us with
+        # gzip.
+        level = args.gc_cc_log_compression_level
+        compressor = None
+        if args.compress_gc_cc_logs:
+            compressor = LogCompressor(format, level)
+        try:
+            utils.notify_and_pull_files(
+                fifo_msg=fifo_msg,
+                outfiles_prefixes=['cc-edges.', 'gc-edges.'],
+                remove_outfiles_from_device=not args.leave_on_device,
+                out_dir=out_dir,
+                on_file_pulled=compressor.add if compressor else None,
+                compress_pulls=args.compress_gc_cc_logs and format == 'gzip' and
+                               not args.compress_gc_cc_logs_on_host,
+                compress_level=level if level is not None else
+                               compression_formats['gzip'][1])
 
-        if get_procrank_etc:
-            utils.pull_procrank_etc(out_dir)
+            if get_procrank_etc:
+                utils.pull_procrank_etc(out_dir)
 
-        if args.compress_gc_cc_logs:
-            compress_logs(log_filenames, out_dir)
+            if compressor:
+                print('Compressing logs...')
+                compressor.finish()
+                compressor = None
+        finally:
+            if compressor:
+                compressor.close()
 
     utils.run_and_delete_dir_on_exception(do_work, out_dir)
 
@@ -118,5 +246,28 @@ if __name__ == '__main__':
         action='store_false', default=True,
         help='Do not compress the individual logs.')
 
+    parser.add_argument('--compress-on-host',
+        dest='compress_gc_cc_logs_on_host',
+        action='store_true', default=False,
+        help=textwrap.dedent('''\
+            Pull the logs uncompressed and compress them on this machine.  By
+            default, we compress the logs on the device (or, if it doesn't have
+            gzip, as we pull them), which sends much less data over USB.  We
+            can only do this with gzip.'''))
+
+    parser.add_argument('--compression-format',
+        dest='gc_cc_log_compression_format',
+        choices=sorted(compression_formats), default='gzip',
+        help=textwrap.dedent('''\
+            The format to compress the logs in.  xz and zstd use the lzma or
+            zstandard Python module if it's installed, or else the xz or zstd
+            program.  (Default: gzip)'''))
+
+    parser.add_argument('--compression-level', type=int,
+        dest='gc_cc_log_compression_level', metavar='LEVEL',
+        help=textwrap.dedent('''\
+            The compression level, e.g. 1 (fastest) to 9 (smallest) for gzip.
+            (Default: 9 for gzip, 6 for xz, 3 for zstd)'''))
+
     args = parser.parse_args()
     get_logs(args)
@@ -0,0 +1,98 @@
+"""Utilities for the on-disk caches which our symbolication tools share."""
+
+from __future__ import print_function
+from __future__ import division
+
+import errno
+import fcntl
+import hashlib
+import os
+
+from . import elf_utils
+
+
+def get_cache_dir():
+    """Return the directory in which we keep caches that can be shared between
+    B2G trees and runs, creating it if necessary.
+
+    This is $B2G_SYMBOL_CACHE_DIR if that's set.  Otherwise, it's
+    $XDG_CACHE_HOME/b2g-symbols, which defaults to ~/.cache/b2g-symbols.
+
+    """
+    cache_dir = os.environ.get('B2G_SYMBOL_CACHE_DIR')
+    if not cache_dir:
+        cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                                 os.path.expanduser('~/.cache'),
+                                 'b2g-symbols')
+    try:
+        os.makedirs(cache_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return cache_dir
+
+
+class FileLock(object):
+    """An exclusive fcntl lock on the file at |path|, for use in a with
+    statement.
+
+    Unlike a non-blocking lock, entering the with block waits for whoever
+    holds the lock to release it, so concurrent writers take turns rather
+    than giving up.
+
+    """
+    def __init__(self, path):
+        self._path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self._path, 'a')
+        fcntl.lockf(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        try:
+            fcntl.lockf(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+
+
+def hash_file(path, block_size=1024 * 1024):
+    """Return the SHA-1 of the contents of the file at path, as a hex
+    string."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def get_lib_key(path):
+    """Return a string which identifies the contents of the library at path.
+
+    This is 'build-id:<id>:<debug info>' if the library has a GNU build-id,
+    and 'sha1:<hash of the file>' otherwise, so two identical copies of a
+    library (e.g. in two checkouts of the same build) get the same key.  A
+    stripped copy of a library has the same build-id as the unstripped one but
+    symbolicates much worse, so the key also says which of .symtab and
+    .debug_line the file has.  Returns None if we can't read the file.
+
+    """
+    try:
+        with elf_utils.ElfFile(path) as elf:
+            build_id = elf.build_id()
+            debug_info = [name for (name, present) in
+                          (('symtab', elf.has_symtab()),
+                           ('debug_line', '.debug_line' in elf.sections))
+                          if present]
+        if build_id:
+            return 'build-id:%s:%s' % (build_id,
+                                       '+'.join(debug_info) or 'stripped')
+    except (IOError, elf_utils.ElfError):
+        pass
+
+    try:
+        return 'sha1:' + hash_file(path)
+    except IOError:
+        return None
@@ -0,0 +1,107 @@
+"""In-process C++ symbol demangling.
+
+We call the host C++ runtime's __cxa_demangle through ctypes, which lets us
+demangle just the symbols we produce, instead of piping all of our output
+through a c++filt process.  The Itanium C++ ABI's mangling is the same on
+every target, so the host's runtime can demangle ARM symbols just fine.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import ctypes
+import ctypes.util
+import re
+
+_runtime_libs = ['libstdc++.so.6', 'libc++abi.dylib', 'libstdc++.6.dylib',
+                 'libc++.so.1']
+
+_cxa_demangle = None
+_free = None
+
+
+def _load_runtime():
+    """Find __cxa_demangle and free(); return True if we succeeded."""
+    global _cxa_demangle, _free
+    if _cxa_demangle:
+        return True
+
+    candidates = [ctypes.util.find_library(name)
+                  for name in ('stdc++', 'c++abi', 'c++')]
+    for lib_name in [c for c in candidates if c] + _runtime_libs:
+        try:
+            lib = ctypes.CDLL(lib_name)
+            cxa_demangle = lib.__cxa_demangle
+            break
+        except (OSError, AttributeError):
+            continue
+    else:
+        return False
+
+    try:
+        free = ctypes.CDLL(ctypes.util.find_library('c')).free
+    except (OSError, AttributeError, TypeError):
+        return False
+
+    cxa_demangle.restype = ctypes.c_void_p
+    cxa_demangle.argtypes = [ctypes.c_char_p, ctypes.c_void_p, ctypes.c_void_p,
+                             ctypes.POINTER(ctypes.c_int)]
+    free.restype = None
+    free.argtypes = [ctypes.c_void_p]
+    (_cxa_demangle, _free) = (cxa_demangle, free)
+    return True
+
+
+def is_available():
+    """Check whether we can demangle in-process on this machine."""
+    return _load_runtime()
+
+
+class Demangler(object):
+    """Demangles the C++ symbols in strings, remembering the result for each
+    mangled name.
+
+    Raises OSError if we can't demangle in-process on this machine; check
+    is_available() first.
+
+    """
+
+    # Mangled names start with _Z; GCC's clones add suffixes like .part.0 or
+    # .constprop.1, which __cxa_demangle understands.
+    _mangled_re = re.compile(r'\b_Z[\w.$]+')
+
+    def __init__(self):
+        if not _load_runtime():
+            raise OSError("Couldn't find __cxa_demangle")
+        self._memo = {}
+
+    def demangle(self, name):
+        """Demangle one symbol.  If it isn't a valid mangled name, return it
+        unchanged."""
+        try:
+            return self._memo[name]
+        except KeyError:
+            pass
+
+        status = ctypes.c_int()
+        encoded = name if isinstance(name, bytes) else name.encode('utf-8')
+        buf = _cxa_demangle(encoded, None, None, ctypes.byref(status))
+        demangled = name
+        if buf:
+            try:
+                if status.value == 0:
+                    demangled = ctypes.string_at(buf)
+                    if not isinstance(demangled, str):
+                        demangled = demangled.decode('utf-8', 'replace')
+            finally:
+                _free(buf)
+
+        self._memo[name] = demangled
+        return demangled
+
+    def demangle_all(self, text):
+        """Demangle every mangled symbol in text, like c++filt does."""
+        if '_Z' not in text:
+            return text
+        return self._mangled_re.sub(lambda m: self.demangle(m.group(0)), text)
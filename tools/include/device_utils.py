@@ -3,13 +3,26 @@
 from __future__ import print_function
 from __future__ import division
 
+import atexit
+import gzip
+import itertools
 import os
 import sys
 import re
+import shutil
+import struct
 import subprocess
+import tempfile
 import textwrap
+import threading
+import time
 from time import sleep
 
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
 
 def remote_shell(cmd, verbose=True):
     """Run the given command on on the device and return stdout.  Throw an
@@ -22,13 +35,23 @@ def remote_shell(cmd, verbose=True):
     ourselves, we echo $? after running the command and then strip that off
     before returning the command's output.
 
-    """
-    out = shell(r"""adb shell '%s; echo -n "|$?"'""" % cmd)
+    We run the command in a long-lived adb shell session (see _ShellSession),
+    rather than starting a new adb shell for every command.  If we can't use
+    the session, we fall back to running the command with its own adb shell.
 
-    # The final '\n' in |out| separates the command output from the return
-    # code.  (There's no newline after the return code because we did echo -n.)
-    (cmd_out, _, retcode) = out.rpartition('|')
-    retcode = retcode.strip()
+    """
+    try:
+        (cmd_out, retcode) = _shell_session.run(cmd)
+    except _ShellSessionError as e:
+        if e.command_started:
+            # The command may have done something before the session broke,
+            # so it isn't safe to run it again.  255 is what adb shell exits
+            # with when it loses the device.
+            if verbose:
+                print('Lost the adb shell session while running %s: %s' %
+                      (cmd, e), file=sys.stderr)
+            raise subprocess.CalledProcessError(255, cmd, '')
+        (cmd_out, retcode) = _remote_shell_once(cmd)
 
     if retcode == '0':
         return cmd_out
@@ -85,6 +108,217 @@ def shell(cmd, cwd=None, show_errors=True):
     return out
 
 
+class _ShellSessionError(Exception):
+    """We couldn't run a command in the adb shell session.
+
+    command_started is true if the session broke after the command started
+    running on the device.
+
+    """
+    def __init__(self, message, command_started=False):
+        Exception.__init__(self, message)
+        self.command_started = command_started
+
+
+class _ShellSession(object):
+    """A long-lived interactive adb shell, which runs one command at a time.
+
+    Starting a new adb shell for every command costs us two process launches
+    and a new adb transport, which adds up when we poll the device many times
+    a second.  Instead, we write each command to one shell's stdin, between
+    commands which echo a begin marker and an end marker followed by the
+    command's exit code.  Each command runs in a subshell, so that a cd,
+    export or exit in one command doesn't affect the commands after it, just
+    as if it had its own adb shell.  A thread reads the shell's output into a queue, from
+    which we take everything between the markers.
+
+    In the text we send, the markers are split up by quotes, so that if adb
+    gives the shell a pty, which echoes our input back to us, the echo doesn't
+    look like a marker.
+
+    We only run one command at a time; other threads wait for their turn on
+    a lock.  If a command doesn't finish within _command_timeout seconds, we
+    kill the session, so that a wedged command can't hold up the other
+    threads forever.  If the session dies (e.g. because the device rebooted),
+    we start a new one for the next command.  If we can't start a session a few times
+    in a row, we give up on it, and remote_shell goes back to starting an adb
+    shell per command.  Setting $B2G_ADB_SHELL_SESSION to 0 does the same.
+
+    """
+
+    _max_failed_starts = 3
+    _start_timeout = 10
+    _command_timeout = 600
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._proc = None
+        self._lines = None
+        self._reader = None
+        self._ids = itertools.count()
+        self._failed_starts = 0
+        self._disabled = os.getenv('B2G_ADB_SHELL_SESSION', '1') == '0'
+        atexit.register(self.close)
+
+    def run(self, cmd):
+        """Run cmd on the device, with its stdin redirected from /dev/null and
+        its stderr into its stdout.  Return a tuple (output, retcode), where
+        retcode is a string, like remote_shell's.
+
+        Raises _ShellSessionError if we couldn't run the command in the
+        session.
+
+        """
+        with self._lock:
+            # If the session died since the last command, try a new one; the
+            # command can't have started if we never got its begin marker.
+            for attempt in range(2):
+                if self._proc is None or self._proc.poll() is not None:
+                    self._start()
+                try:
+                    return self._run(cmd, timeout=self._command_timeout)
+                except _ShellSessionError as e:
+                    self._stop()
+                    if e.command_started or attempt:
+                        raise
+
+    def close(self):
+        with self._lock:
+            self._stop()
+
+    def _start(self):
+        self._stop()
+        if self._disabled:
+            raise _ShellSessionError('the adb shell session is disabled')
+        try:
+            self._proc = subprocess.Popen(['adb', 'shell'],
+                                          stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE,
+                                          stderr=subprocess.STDOUT)
+        except OSError as e:
+            self._proc = None
+            self._start_failed()
+            raise _ShellSessionError("couldn't run adb shell: %s" % e)
+
+        self._lines = queue.Queue()
+        self._reader = threading.Thread(target=self._read_lines,
+                                        args=(self._proc.stdout, self._lines))
+        self._reader.daemon = True
+        self._reader.start()
+
+        # Make sure the shell is listening before we trust it with a command.
+        try:
+            self._run(':', timeout=self._start_timeout)
+        except _ShellSessionError:
+            self._stop()
+            self._start_failed()
+            raise
+        self._failed_starts = 0
+
+    def _start_failed(self):
+        self._failed_starts += 1
+        if self._failed_starts >= self._max_failed_starts:
+            self._disabled = True
+
+    def _stop(self):
+        (proc, reader) = (self._proc, self._reader)
+        self._proc = None
+        self._lines = None
+        self._reader = None
+        if proc is None:
+            return
+        try:
+            proc.stdin.write(b'exit\n')
+            proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        # Give the shell a moment to exit by itself before we kill it.
+        for i in range(10):
+            if proc.poll() is not None:
+                break
+            sleep(0.05)
+        else:
+            try:
+                proc.kill()
+            except OSError:
+                pass
+            proc.wait()
+        # Let the reader see the end of the shell's output, so that it isn't
+        # still running when the interpreter shuts down.
+        reader.join(1)
+
+    @staticmethod
+    def _read_lines(stdout, lines):
+        for line in iter(stdout.readline, b''):
+            lines.put(line)
+        # Tell the reader that the shell went away.
+        lines.put(None)
+
+    def _run(self, cmd, timeout=None):
+        id = next(self._ids)
+        begin = '__b2g_begin_%d__' % id
+        end = '__b2g_end_%d__' % id
+        # Everything goes on one line, so that an interactive shell doesn't
+        # print its continuation prompt in the middle of the output.
+        script = ('echo "%s""%s"; ( %s ) </dev/null 2>&1; echo "%s""%s|$?"\n' %
+                  (begin[:6], begin[6:], cmd, end[:6], end[6:]))
+        try:
+            self._proc.stdin.write(script.encode('utf-8')
+                                   if not isinstance(script, bytes) else script)
+            self._proc.stdin.flush()
+        except (IOError, OSError) as e:
+            raise _ShellSessionError("couldn't write to adb shell: %s" % e)
+
+        deadline = time.time() + timeout if timeout is not None else None
+        started = False
+        out = []
+        while True:
+            line = self._next_line(deadline, started)
+            if not started:
+                # Skip our echoed input and any prompts.
+                started = begin in line
+                continue
+            i = line.find(end)
+            if i < 0:
+                out.append(line)
+                continue
+            # If the command's output doesn't end in a newline, the end
+            # marker comes at the end of its last line.
+            out.append(line[:i])
+            retcode = line[i + len(end):].strip().lstrip('|')
+            return (''.join(out), retcode)
+
+    def _next_line(self, deadline, command_started):
+        # Wait in short steps, so that we notice a KeyboardInterrupt.
+        while True:
+            try:
+                line = self._lines.get(timeout=0.5)
+                break
+            except queue.Empty:
+                if deadline is not None and time.time() > deadline:
+                    raise _ShellSessionError('adb shell stopped responding',
+                                             command_started)
+        if line is None:
+            raise _ShellSessionError('adb shell exited', command_started)
+        if not isinstance(line, str):
+            line = line.decode('utf-8', 'replace')
+        return line
+
+
+_shell_session = _ShellSession()
+
+
+def _remote_shell_once(cmd):
+    """Run cmd with its own adb shell, and return a tuple (output, retcode),
+    like _ShellSession.run."""
+    out = shell(r"""adb shell '%s; echo -n "|$?"'""" % cmd)
+
+    # The final '\n' in |out| separates the command output from the return
+    # code.  (There's no newline after the return code because we did echo -n.)
+    (cmd_out, _, retcode) = out.rpartition('|')
+    return (cmd_out, retcode.strip())
+
+
 def get_archive_path(out_dir, extension='.tar.bz2'):
     """Gets the full path for an archive that would contain the given out_dir"""
     return out_dir.rstrip(os.path.sep) + extension
@@ -198,7 +432,10 @@ def notify_and_pull_files(outfiles_prefixes,
                           optional_outfiles_prefixes=[],
                           fifo_msg=None,
                           signal=None,
-                          ignore_nuwa=is_using_nuwa()):
+                          ignore_nuwa=is_using_nuwa(),
+                          on_file_pulled=None,
+                          compress_pulls=False,
+                          compress_level=6):
     """Send a message to the main B2G process (either by sending it a signal or
     by writing to a fifo that it monitors) and pull files created as a result.
 
@@ -230,6 +467,16 @@ def notify_and_pull_files(outfiles_prefixes,
     device.  If that succeeds, we then pull all files which match
     optional_outfiles_prefixes.
 
+    We pull each file as soon as b2g finishes writing it, a few at a time (see
+    PullScheduler).  If on_file_pulled is given, we call it with the path of
+    each file on the host as soon as we've pulled it, on the thread which
+    pulled it, so that you can start processing the file while we pull the
+    rest.
+
+    If compress_pulls is true, we gzip each file (at compress_level) before it
+    reaches the host's disk, and store it with '.gz' added to its name; the
+    filenames we return include the '.gz'.
+
     """
 
     if (fifo_msg is None) == (signal is None):
@@ -261,36 +508,83 @@ def notify_and_pull_files(outfiles_prefixes,
 
     max_wait = 60 * 2
     wait_interval = 1.0
-    for i in range(0, int(max_wait / wait_interval)):
-        new_files = _list_remote_temp_files(outfiles_prefixes) - old_files
-        new_unified_files = _list_remote_temp_files(unified_outfiles_prefixes) - old_files
-        if new_unified_files:
-            files_gotten = len(new_unified_files)
-            files_expected = num_unified_expected
-        else:
-            files_gotten = len(new_files)
-            files_expected = num_expected_files
-        sys.stdout.write('\rGot %d/%d files.' % (files_gotten, files_expected))
-        sys.stdout.flush()
-
-        if files_gotten >= files_expected:
-            print('')
-            if files_gotten > files_expected:
-                print("WARNING: Got more files than expected!", file=sys.stderr)
-                print("(Is MOZ_IGNORE_NUWA_PROCESS set incorrectly?)", file=sys.stderr)
-            break
-
-        sleep(wait_interval)
-
-        # Some pids may have gone away before reporting memory. This can happen
-        # normally if the triggering of memory reporting causes some old
-        # children to OOM. (Bug 931198)
-        dead_child_pids = child_pids - set(get_remote_b2g_pids()[1])
-        if len(dead_child_pids):
-            for pid in dead_child_pids:
-                print("\rWarning: Child %u exited during memory reporting" % pid, file=sys.stderr)
-            child_pids -= dead_child_pids
-            num_expected_files -= len(outfiles_prefixes) * len(dead_child_pids)
+
+    # B2G writes each file under a name starting with "incomplete-" and
+    # renames it when it's done, so as soon as we see a file with one of our
+    # prefixes, we can pull it.  We watch for the files with a loop on the
+    # device (see _RemoteFileWatcher); if that doesn't work, we poll.
+    watcher = _RemoteFileWatcher(_remote_temp_dirs)
+    if not watcher.start():
+        watcher = None
+    scheduler = PullScheduler(out_dir, on_done=on_file_pulled,
+                              compress=compress_pulls,
+                              compress_level=compress_level)
+    pulled_files = set()
+    new_files = new_unified_files = set()
+    last_status = None
+    start_time = time.time()
+    last_pid_check = start_time
+    try:
+        while True:
+            listing = None
+            if watcher:
+                listing = watcher.next_listing(timeout=wait_interval)
+                if listing is None and not watcher.is_alive():
+                    print('\rLost the connection to the file watcher on the '
+                          'device; polling instead.', file=sys.stderr)
+                    watcher.stop()
+                    watcher = None
+            if watcher is None:
+                listing = _list_remote_temp_files(outfiles_prefixes +
+                                                  unified_outfiles_prefixes)
+
+            if listing is not None:
+                new_files = _filter_by_prefixes(listing, outfiles_prefixes) - old_files
+                new_unified_files = _filter_by_prefixes(
+                    listing, unified_outfiles_prefixes) - old_files
+                for f in sorted((new_files | new_unified_files) - pulled_files):
+                    scheduler.pull(f)
+                    pulled_files.add(f)
+
+            if new_unified_files:
+                files_gotten = len(new_unified_files)
+                files_expected = num_unified_expected
+            else:
+                files_gotten = len(new_files)
+                files_expected = num_expected_files
+            if (files_gotten, files_expected) != last_status:
+                sys.stdout.write('\rGot %d/%d files.' % (files_gotten, files_expected))
+                sys.stdout.flush()
+                last_status = (files_gotten, files_expected)
+
+            if files_gotten >= files_expected:
+                print('')
+                if files_gotten > files_expected:
+                    print("WARNING: Got more files than expected!", file=sys.stderr)
+                    print("(Is MOZ_IGNORE_NUWA_PROCESS set incorrectly?)", file=sys.stderr)
+                break
+
+            now = time.time()
+            if now - start_time >= max_wait:
+                break
+            if watcher is None:
+                sleep(wait_interval)
+            elif now - last_pid_check < wait_interval:
+                continue
+            last_pid_check = time.time()
+
+            # Some pids may have gone away before reporting memory. This can happen
+            # normally if the triggering of memory reporting causes some old
+            # children to OOM. (Bug 931198)
+            dead_child_pids = child_pids - set(get_remote_b2g_pids()[1])
+            if len(dead_child_pids):
+                for pid in dead_child_pids:
+                    print("\rWarning: Child %u exited during memory reporting" % pid, file=sys.stderr)
+                child_pids -= dead_child_pids
+                num_expected_files -= len(outfiles_prefixes) * len(dead_child_pids)
+    finally:
+        if watcher:
+            watcher.stop()
 
     if files_gotten < files_expected:
         print('')
@@ -298,12 +592,20 @@ def notify_and_pull_files(outfiles_prefixes,
         print('\n'.join(['  ' + f for f in new_files | new_unified_files]), file=sys.stderr)
         print('We expected %d but see only %d files.  Giving up...' %
               (files_expected, files_gotten), file=sys.stderr)
+        scheduler.wait(report=False)
         raise Exception("Unable to pull some files.")
 
-    new_files = _pull_remote_files(all_outfiles_prefixes, old_files, out_dir)
+    # Pull the optional files, and anything else which turned up since we
+    # last looked.
+    new_files = pulled_files | _pull_remote_files(all_outfiles_prefixes,
+                                                  old_files | pulled_files,
+                                                  scheduler)
+    scheduler.wait()
+    print("Pulled files into %s." % out_dir)
     if remove_outfiles_from_device:
         _remove_files_from_device(all_outfiles_prefixes, old_files)
-    return [os.path.basename(f) for f in new_files]
+    suffix = '.gz' if compress_pulls else ''
+    return [os.path.basename(f) + suffix for f in new_files]
 
 
 def pull_remote_file(remote_file, dest_file):
@@ -311,6 +613,241 @@ def pull_remote_file(remote_file, dest_file):
     shell('adb pull "%s" "%s"' % (remote_file, dest_file))
 
 
+class PullScheduler(object):
+    """Pulls files from the device into out_dir, up to max_pulls at a time.
+
+    Call pull() with each file as soon as it's ready on the device.  We start
+    pulling it right away if fewer than max_pulls pulls are running, and
+    otherwise as soon as one of them finishes.  If on_done is given, we call
+    on_done(path on the host) on the pulling thread once each pull finishes,
+    so that the caller can start processing the file (e.g. compressing it)
+    while we pull the others.
+
+    If compress is true, we gzip each file at compress_level on its way to the
+    host and store it as <name>.gz (see _pull_compressed).
+
+    Call wait() once you've asked for every file.  It waits for the pulls and
+    for on_done, prints how fast we pulled, and re-raises the first error, if
+    any pull or on_done failed.
+
+    """
+
+    _block_size = 1024 * 1024
+
+    def __init__(self, out_dir, max_pulls=4, on_done=None, compress=False,
+                 compress_level=6):
+        self._out_dir = out_dir
+        self._max_pulls = max_pulls
+        self._on_done = on_done
+        self._compress = compress
+        self._compress_level = compress_level
+        self._files = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._errors = []
+        self._num_pulled = 0
+        self._bytes_pulled = 0
+        self._start_time = None
+        self._end_time = None
+
+    def pull(self, remote_file):
+        if self._start_time is None:
+            self._start_time = time.time()
+        self._files.put(remote_file)
+        if len(self._threads) < self._max_pulls:
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def wait(self, report=True):
+        for thread in self._threads:
+            self._files.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+        if report and self._num_pulled:
+            elapsed = max(self._end_time - self._start_time, 1e-3)
+            print('Pulled %d file(s) (%.1f MB) in %.1fs (%.1f MB/s).' %
+                  (self._num_pulled, self._bytes_pulled / 1e6, elapsed,
+                   self._bytes_pulled / 1e6 / elapsed))
+        if self._errors:
+            exception_info = self._errors[0]
+            self._errors = []
+            raise exception_info[1], None, exception_info[2]
+
+    def _work(self):
+        while True:
+            remote_file = self._files.get()
+            if remote_file is None:
+                return
+            local_file = os.path.join(self._out_dir,
+                                      os.path.basename(remote_file))
+            try:
+                if self._compress:
+                    (local_file, size) = self._pull_compressed(remote_file,
+                                                               local_file)
+                else:
+                    self._pull(remote_file, local_file)
+                    size = os.path.getsize(local_file)
+                with self._lock:
+                    self._num_pulled += 1
+                    self._bytes_pulled += size
+                    self._end_time = time.time()
+                if self._on_done:
+                    self._on_done(local_file)
+            except:
+                with self._lock:
+                    self._errors.append(sys.exc_info())
+
+    @staticmethod
+    def _pull(remote_file, local_file):
+        # Run adb directly, rather than through a shell, and keep its output
+        # (e.g. its progress messages) to ourselves unless it fails.
+        cmd = ['adb', 'pull', remote_file, local_file]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        out = proc.communicate()[0]
+        if proc.returncode:
+            print('Command %s failed with error code %d' %
+                  (' '.join(cmd), proc.returncode), file=sys.stderr)
+            if out:
+                print(out, file=sys.stderr)
+            raise subprocess.CalledProcessError(proc.returncode, cmd, out)
+
+    def _pull_compressed(self, remote_file, local_file):
+        """Pull remote_file into local_file + '.gz', compressing it on the way.
+        Return the path of the compressed file and the number of bytes we
+        transferred.
+
+        If the device has gzip, we compress the file there, and stream the
+        compressed bytes over adb exec-out straight into the .gz file.
+        Otherwise, we stream the file with adb exec-out cat into a gzip writer
+        on the host.  exec-out, unlike adb shell, doesn't mangle binary output.
+        Either way, nothing uncompressed touches the host's disk.  We check
+        that we got the whole file by comparing its size on the device with
+        how many bytes we got, or, for gzip, with the size recorded in the
+        gzip trailer.  Old adbds don't pass the command's exit status back
+        through exec-out, so this is our only way to tell that the stream was
+        cut short.
+
+        If we can't find out the file's size on the device, or streaming
+        doesn't work (e.g. because the device's adbd is too old for exec-out),
+        we pull the file as it is and compress it on the host.
+
+        """
+        gz_file = local_file + '.gz'
+        remote_size = _remote_file_size(remote_file)
+        if remote_size is not None:
+            try:
+                return self._stream_compressed(remote_file, gz_file,
+                                               remote_size)
+            except (IOError, OSError, subprocess.CalledProcessError):
+                pass
+            try:
+                os.remove(gz_file)
+            except OSError:
+                pass
+
+        self._pull(remote_file, local_file)
+        size = os.path.getsize(local_file)
+        _gzip_file(local_file, gz_file, self._compress_level)
+        os.remove(local_file)
+        return (gz_file, size)
+
+    def _stream_compressed(self, remote_file, gz_file, remote_size):
+        """Stream remote_file, which is remote_size bytes long, into gz_file
+        over adb exec-out, and return (gz_file, bytes transferred).  Raise
+        IOError if we didn't get the whole file."""
+        gzip_cmd = _device_gzip_command()
+        if gzip_cmd:
+            with open(gz_file, 'wb') as f:
+                transferred = self._exec_out('%s -%d -c "%s"' % (
+                    gzip_cmd, self._compress_level, remote_file), f)
+            with open(gz_file, 'rb') as f:
+                magic = f.read(2)
+                f.seek(-4, os.SEEK_END)
+                isize = struct.unpack('<I', f.read(4))[0]
+            complete = magic == b'\x1f\x8b' and \
+                isize == remote_size & 0xffffffff
+        else:
+            with gzip.GzipFile(gz_file, 'wb',
+                               compresslevel=self._compress_level) as f:
+                transferred = self._exec_out('cat "%s"' % remote_file, f)
+            complete = transferred == remote_size
+        if not complete:
+            raise IOError('Only got part of %s from the device' % remote_file)
+        return (gz_file, transferred)
+
+    def _exec_out(self, remote_cmd, out):
+        """Run remote_cmd on the device with adb exec-out, writing its output
+        to out, and return how many bytes it wrote."""
+        cmd = ['adb', 'exec-out', remote_cmd]
+        with open(os.devnull, 'rb') as devnull, tempfile.TemporaryFile() as err:
+            proc = subprocess.Popen(cmd, stdin=devnull, stdout=subprocess.PIPE,
+                                    stderr=err)
+            transferred = 0
+            while True:
+                block = proc.stdout.read(self._block_size)
+                if not block:
+                    break
+                out.write(block)
+                transferred += len(block)
+            proc.wait()
+            if proc.returncode:
+                err.seek(0)
+                raise subprocess.CalledProcessError(proc.returncode, cmd,
+                                                    err.read())
+        return transferred
+
+
+# The command which runs gzip on the device, or '' if the device doesn't have
+# gzip; see _device_gzip_command.
+_device_gzip = None
+_device_gzip_lock = threading.Lock()
+
+
+def _device_gzip_command():
+    """Return the command to run gzip on the device (e.g. 'busybox gzip'), or
+    '' if the device doesn't have one."""
+    global _device_gzip
+    with _device_gzip_lock:
+        if _device_gzip is None:
+            _device_gzip = ''
+            for cmd in ('gzip', 'busybox gzip'):
+                try:
+                    remote_shell('echo | %s -c > /dev/null' % cmd, verbose=False)
+                    _device_gzip = cmd
+                    break
+                except subprocess.CalledProcessError:
+                    pass
+        return _device_gzip
+
+
+def _remote_file_size(remote_file):
+    """Return the size of a file on the device, or None if we can't tell."""
+    try:
+        out = remote_toolbox_cmd('ls', '-l "%s"' % remote_file, verbose=False)
+    except subprocess.CalledProcessError:
+        return None
+    # toolbox's ls -l prints "mode owner group size date time name"; toybox's
+    # adds a link count after the mode.  Either way, the size comes right
+    # before the date.
+    fields = out.split()
+    for (i, field) in enumerate(fields[1:], 1):
+        if re.match(r'^\d{4}-\d\d-\d\d$', field) and fields[i - 1].isdigit():
+            return int(fields[i - 1])
+    return None
+
+
+def _gzip_file(path, gz_path, level=6):
+    """Compress the file at path into gz_path."""
+    with open(path, 'rb') as f_in:
+        with gzip.GzipFile(gz_path, 'wb', compresslevel=level) as f_out:
+            shutil.copyfileobj(f_in, f_out, PullScheduler._block_size)
+
+
 # You probably don't need to call the functions below from outside this module,
 # but hey, maybe you do.
 
@@ -339,16 +876,19 @@ def _write_to_remote_file(file, msg):
     remote_shell('echo -n "%s" > "%s"' % (msg, file))
 
 
+# The directories on the device where b2g writes its reports and logs.  New
+# versions of b2g dump everything into /data/local/tmp/memory-reports, but old
+# versions use /data/local/tmp for some things (e.g. gc/cc logs).
+_remote_temp_dirs = ['/data/local/tmp/', '/data/local/tmp/memory-reports']
+
+
 def _list_remote_temp_files(prefixes):
     """Return a set of absolute filenames in the device's temp directory which
     start with one of the given prefixes."""
 
     # Look for files in both /data/local/tmp/ and
-    # /data/local/tmp/memory-reports.  New versions of b2g dump everything into
-    # /data/local/tmp/memory-reports, but old versions use /data/local/tmp for
-    # some things (e.g. gc/cc logs).
-    tmpdir = '/data/local/tmp/'
-    outdirs = [d for d in [tmpdir, os.path.join(tmpdir, 'memory-reports')] if
+    # /data/local/tmp/memory-reports.
+    outdirs = [d for d in _remote_temp_dirs if
                os.path.basename(d) in remote_ls(os.path.dirname(d))]
 
     found_files = set()
@@ -359,18 +899,132 @@ def _list_remote_temp_files(prefixes):
     return found_files
 
 
-def _pull_remote_files(outfiles_prefixes, old_files, out_dir):
-    """Pull files from the remote device's temp directory into out_dir.
+def _filter_by_prefixes(files, prefixes):
+    """Return the set of files whose basenames start with one of prefixes."""
+    prefixes = tuple(prefixes)
+    return {f for f in files if os.path.basename(f).startswith(prefixes)}
+
+
+class _RemoteFileWatcher(object):
+    """Watches directories on the device for new files.
+
+    Rather than listing each directory with its own adb command every time
+    we poll, we start one adb shell which runs a loop on the device.  The loop
+    lists the directories a few times a second and sends us each listing.  A
+    thread reads the listings and puts each one, as a set of paths, in a
+    queue.
+
+    Older versions of toolbox's sleep only take whole seconds; on those
+    devices, the loop lists the directories once a second.
+
+    """
+
+    _start_timeout = 10
+
+    def __init__(self, dirs, interval=0.2):
+        self._dirs = dirs
+        self._interval = interval
+        self._proc = None
+        self._listings = None
+
+    def start(self):
+        """Start watching.  Return False if we couldn't start the loop on the
+        device."""
+        script = ('while :; do echo __b2g_listing__; '
+                  'for d in %s; do echo "__b2g_dir__ $d"; '
+                  '/system/bin/toolbox ls "$d" 2>/dev/null; done; '
+                  'echo __b2g_listing_end__; '
+                  'sleep %s 2>/dev/null || sleep 1; done' %
+                  (' '.join(self._dirs), self._interval))
+        try:
+            self._proc = subprocess.Popen(['adb', 'shell', script],
+                                          stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE,
+                                          stderr=subprocess.STDOUT)
+        except OSError:
+            return False
+        self._listings = queue.Queue()
+        reader = threading.Thread(target=self._read_listings,
+                                  args=(self._proc.stdout, self._listings))
+        reader.daemon = True
+        reader.start()
+
+        # Wait for the first listing, so we know the loop works.
+        try:
+            listing = self._listings.get(timeout=self._start_timeout)
+        except queue.Empty:
+            listing = None
+        if listing is None:
+            self.stop()
+            return False
+        self._listings.put(listing)
+        return True
+
+    def is_alive(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def next_listing(self, timeout):
+        """Return the newest listing we've received, waiting up to timeout
+        seconds for one, or None if we didn't get one."""
+        try:
+            listing = self._listings.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        # If we fell behind, skip to the newest listing.
+        while listing is not None:
+            try:
+                newer = self._listings.get_nowait()
+            except queue.Empty:
+                break
+            if newer is None:
+                break
+            listing = newer
+        return listing
+
+    def stop(self):
+        if self._proc is None:
+            return
+        try:
+            self._proc.kill()
+        except OSError:
+            pass
+        self._proc.wait()
+        self._proc = None
+
+    @staticmethod
+    def _read_listings(stdout, listings):
+        listing = None
+        dir = None
+        for line in iter(stdout.readline, b''):
+            if not isinstance(line, str):
+                line = line.decode('utf-8', 'replace')
+            line = line.strip()
+            if line == '__b2g_listing__':
+                listing = set()
+            elif listing is None:
+                continue
+            elif line == '__b2g_listing_end__':
+                listings.put(listing)
+                listing = None
+            elif line.startswith('__b2g_dir__ '):
+                dir = line[len('__b2g_dir__ '):]
+            elif line:
+                listing.add(os.path.join(dir, line))
+        # Tell the reader that the loop went away.
+        listings.put(None)
+
+
+def _pull_remote_files(outfiles_prefixes, old_files, scheduler):
+    """Pull files from the remote device's temp directory with the given
+    PullScheduler.
 
     We pull each file in the temp directory whose name begins with one of the
     elements of outfiles_prefixes and which isn't listed in old_files.
 
     """
     new_files = _list_remote_temp_files(outfiles_prefixes) - old_files
-    for f in new_files:
-        shell('adb pull %s' % f, cwd=out_dir)
-        pass
-    print("Pulled files into %s." % out_dir)
+    for f in sorted(new_files):
+        scheduler.pull(f)
     return new_files
 
 
@@ -0,0 +1,565 @@
+"""Utilities for reading symbols and line tables out of ELF files.
+
+This lets us symbolicate addresses in-process, without shelling out to a
+cross-toolchain's addr2line and nm.  We read each library's .symtab (or
+.dynsym, if the library is stripped) and its DWARF .debug_line table once,
+into sorted arrays, and then answer lookups by bisecting those arrays.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import mmap
+import struct
+import zlib
+from array import array
+from bisect import bisect_right
+
+# e_ident[EI_CLASS] and e_ident[EI_DATA] values.
+ELFCLASS64 = 2
+ELFDATA2MSB = 2
+
+EM_ARM = 40
+
+SHT_SYMTAB = 2
+SHT_NOTE = 7
+SHT_NOBITS = 8
+SHT_DYNSYM = 11
+SHF_COMPRESSED = 0x800
+
+STT_NOTYPE = 0
+STT_FUNC = 2
+
+NT_GNU_BUILD_ID = 3
+
+
+class ElfError(Exception):
+    pass
+
+
+def _native_str(b):
+    """Convert bytes read from an ELF file into a native str."""
+    b = bytes(b)
+    if isinstance(b, str):
+        # Python 2.
+        return b
+    return b.decode('utf-8', 'replace')
+
+
+def is_elf_file(path):
+    """Check whether the file at path starts with the ELF magic number."""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(4) == b'\x7fELF'
+    except IOError:
+        return False
+
+
+class ElfFile(object):
+    """A read-only, memory-mapped view of an ELF file's sections.
+
+    Please be kind and call close() once you're done with this object (or use
+    it as a context manager).
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._data = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            # mmap fails on empty files.
+            self._file.close()
+            raise ElfError('%s is not an ELF file' % path)
+
+        try:
+            self._read_header()
+        except ElfError:
+            self.close()
+            raise
+        except (struct.error, IndexError):
+            # A truncated file, or one whose headers point past its end.
+            self.close()
+            raise ElfError('%s is not a valid ELF file' % path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+        self._file.close()
+
+    def _read_header(self):
+        ident = self._data[:16]
+        if ident[:4] != b'\x7fELF':
+            raise ElfError('%s is not an ELF file' % self.path)
+        self.is_64 = bytearray(ident)[4] == ELFCLASS64
+        self.endian = '>' if bytearray(ident)[5] == ELFDATA2MSB else '<'
+        self.address_size = 8 if self.is_64 else 4
+
+        (self.machine,) = struct.unpack_from(self.endian + 'H', self._data, 18)
+        if self.is_64:
+            (shoff,) = struct.unpack_from(self.endian + 'Q', self._data, 40)
+            (shentsize, shnum, shstrndx) = \
+                struct.unpack_from(self.endian + 'HHH', self._data, 58)
+        else:
+            (shoff,) = struct.unpack_from(self.endian + 'I', self._data, 32)
+            (shentsize, shnum, shstrndx) = \
+                struct.unpack_from(self.endian + 'HHH', self._data, 46)
+
+        section_fmt = self.endian + ('IIQQQQIIQQ' if self.is_64 else 'IIIIIIIIII')
+        headers = []
+        for i in range(shnum):
+            headers.append(struct.unpack_from(section_fmt, self._data,
+                                              shoff + i * shentsize))
+
+        self.sections = {}
+        self._section_list = []
+        if not headers:
+            return
+        shstrtab_offset = headers[shstrndx][4]
+        for (name, type, flags, addr, offset, size, link, _, _, entsize) in headers:
+            section = {
+                'name': self._read_cstring(shstrtab_offset + name),
+                'type': type,
+                'flags': flags,
+                'addr': addr,
+                'offset': offset,
+                'size': size,
+                'link': link,
+                'entsize': entsize,
+            }
+            self._section_list.append(section)
+            self.sections.setdefault(section['name'], section)
+
+    def _read_cstring(self, offset):
+        end = self._data.find(b'\0', offset)
+        return _native_str(self._data[offset:end])
+
+    def section_data(self, name):
+        """Return the (decompressed) contents of the named section, or None if
+        there's no such section."""
+        section = self.sections.get(name)
+        if not section or section['type'] == SHT_NOBITS:
+            return None
+        data = self._data[section['offset']:section['offset'] + section['size']]
+        if section['flags'] & SHF_COMPRESSED:
+            # Skip the Elf_Chdr; we only support zlib (ch_type == 1).
+            header_size = 24 if self.is_64 else 12
+            try:
+                (ch_type,) = struct.unpack_from(self.endian + 'I', data, 0)
+                if ch_type != 1:
+                    return None
+                data = zlib.decompress(data[header_size:])
+            except (struct.error, zlib.error):
+                raise ElfError('%s has a corrupt %s section' % (self.path, name))
+        return data
+
+    def has_symtab(self):
+        """Check if this file has a (non-empty) .symtab, i.e. if it's not
+        stripped.  This is the in-process equivalent of checking whether nm
+        prints anything."""
+        return any(s['type'] == SHT_SYMTAB and s['size'] > s['entsize']
+                   for s in self._section_list)
+
+    def build_id(self):
+        """Return the GNU build-id of this file as a hex string, or None if it
+        doesn't have one."""
+        for section in self._section_list:
+            if section['type'] != SHT_NOTE:
+                continue
+            data = self._data[section['offset']:section['offset'] + section['size']]
+            pos = 0
+            while pos + 12 <= len(data):
+                (namesz, descsz, type) = struct.unpack_from(self.endian + 'III',
+                                                            data, pos)
+                pos += 12
+                name = data[pos:pos + namesz]
+                pos += (namesz + 3) & ~3
+                desc = data[pos:pos + descsz]
+                pos += (descsz + 3) & ~3
+                if type == NT_GNU_BUILD_ID and name.rstrip(b'\0') == b'GNU':
+                    return ''.join('%02x' % b for b in bytearray(desc))
+        return None
+
+    def function_symbols(self):
+        """Return a list of (address, size, name) tuples for the functions in
+        this file's .symtab, or in its .dynsym if there's no .symtab."""
+        try:
+            return self._function_symbols()
+        except (struct.error, IndexError):
+            raise ElfError('%s has a corrupt symbol table' % self.path)
+
+    def _function_symbols(self):
+        tables = [s for s in self._section_list if s['type'] == SHT_SYMTAB]
+        if not tables:
+            tables = [s for s in self._section_list if s['type'] == SHT_DYNSYM]
+
+        if self.is_64:
+            sym_fmt = self.endian + 'IBBHQQ'
+        else:
+            sym_fmt = self.endian + 'IIIBBH'
+        sym_size = struct.calcsize(sym_fmt)
+
+        thumb = self.machine == EM_ARM
+        symbols = []
+        for table in tables:
+            strtab_offset = self._section_list[table['link']]['offset']
+            for pos in range(table['offset'] + sym_size,
+                             table['offset'] + table['size'], sym_size):
+                fields = struct.unpack_from(sym_fmt, self._data, pos)
+                if self.is_64:
+                    (name, info, _, shndx, value, size) = fields
+                else:
+                    (name, value, size, info, _, shndx) = fields
+                type = info & 0xf
+                if shndx == 0 or type not in (STT_FUNC, STT_NOTYPE):
+                    continue
+                name = self._read_cstring(strtab_offset + name)
+                # Skip ARM mapping symbols ($a, $t, $d) and other local
+                # labels.
+                if not name or name.startswith('$') or name.startswith('.L'):
+                    continue
+                if type == STT_NOTYPE and size == 0 and not name.startswith('_Z'):
+                    continue
+                if thumb and type == STT_FUNC:
+                    # The low bit of a function symbol's value is set for
+                    # Thumb functions.
+                    value &= ~1
+                symbols.append((value, size, name))
+        return symbols
+
+
+def _read_uleb128(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return (result, pos)
+
+
+def _read_sleb128(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            if byte & 0x40:
+                result -= 1 << shift
+            return (result, pos)
+
+
+def _read_cstring_at(data, pos):
+    end = data.index(b'\0', pos)
+    return (_native_str(data[pos:end]), end + 1)
+
+
+# DWARF forms which can appear in a DWARF 5 line table header.
+DW_FORM_block = 0x09
+DW_FORM_block1 = 0x0a
+DW_FORM_data1 = 0x0b
+DW_FORM_data2 = 0x05
+DW_FORM_data4 = 0x06
+DW_FORM_data8 = 0x07
+DW_FORM_data16 = 0x1e
+DW_FORM_string = 0x08
+DW_FORM_strp = 0x0e
+DW_FORM_line_strp = 0x1f
+DW_FORM_udata = 0x0f
+
+DW_LNCT_path = 1
+DW_LNCT_directory_index = 2
+
+
+class LineTable(object):
+    """The rows of an ELF file's DWARF .debug_line section, sorted by address.
+
+    lookup(address) returns a 'file:line' string for the given address, or
+    None if the address isn't covered by the table.
+
+    """
+    def __init__(self, elf):
+        self._files = []
+        self._addresses = array('L')
+        self._file_indexes = array('l')
+        self._lines = array('l')
+
+        data = elf.section_data('.debug_line')
+        if not data:
+            return
+        self._endian = elf.endian
+        self._address_size = elf.address_size
+        self._line_str = bytearray(elf.section_data('.debug_line_str') or b'')
+        self._str = bytearray(elf.section_data('.debug_str') or b'')
+        self._file_ids = {}
+
+        # Each sequence is monotonic in address, so we collect whole sequences
+        # and then sort the sequences by their start address, rather than
+        # sorting all of the rows.
+        sequences = []
+        data = bytearray(data)
+        pos = 0
+        while pos < len(data):
+            try:
+                pos = self._read_unit(data, pos, sequences)
+            except (IndexError, ValueError, struct.error):
+                # Give up on the rest of a malformed table.
+                break
+
+        sequences.sort(key=lambda seq: seq[0][0] if seq[0] else 0)
+        for (addresses, file_indexes, lines) in sequences:
+            self._addresses.extend(addresses)
+            self._file_indexes.extend(file_indexes)
+            self._lines.extend(lines)
+
+    def lookup(self, address):
+        i = bisect_right(self._addresses, address) - 1
+        if i < 0 or self._file_indexes[i] < 0:
+            return None
+        return '%s:%d' % (self._files[self._file_indexes[i]], self._lines[i])
+
+    def _file_id(self, name):
+        try:
+            return self._file_ids[name]
+        except KeyError:
+            self._file_ids[name] = len(self._files)
+            self._files.append(name)
+            return self._file_ids[name]
+
+    def _unpack(self, fmt, data, pos):
+        return struct.unpack_from(self._endian + fmt, bytes(data[pos:pos + 8]))[0]
+
+    def _read_offset(self, data, pos, offset_size):
+        return (self._unpack('Q' if offset_size == 8 else 'I', data, pos),
+                pos + offset_size)
+
+    def _read_unit(self, data, pos, sequences):
+        """Read one line number program starting at data[pos], append its
+        sequences to |sequences|, and return the position of the next unit."""
+        (unit_length, pos) = self._read_offset(data, pos, 4)
+        offset_size = 4
+        if unit_length == 0xffffffff:
+            (unit_length, pos) = self._read_offset(data, pos, 8)
+            offset_size = 8
+        unit_end = pos + unit_length
+
+        version = self._unpack('H', data, pos)
+        pos += 2
+        address_size = self._address_size
+        if version >= 5:
+            address_size = data[pos]
+            pos += 2
+        (header_length, pos) = self._read_offset(data, pos, offset_size)
+        program_start = pos + header_length
+
+        min_inst_length = data[pos]
+        pos += 1
+        if version >= 4:
+            pos += 1  # maximum_operations_per_instruction; VLIW only.
+        default_is_stmt = data[pos]
+        line_base = struct.unpack('b', bytes(data[pos + 1:pos + 2]))[0]
+        line_range = data[pos + 2]
+        opcode_base = data[pos + 3]
+        pos += 4
+        standard_opcode_lengths = data[pos:pos + opcode_base - 1]
+        pos += opcode_base - 1
+
+        if version >= 5:
+            (dirs, pos) = self._read_v5_entries(data, pos, offset_size)
+            dirs = [entry.get(DW_LNCT_path, '') for entry in dirs]
+            (entries, pos) = self._read_v5_entries(data, pos, offset_size)
+            files = []
+            for entry in entries:
+                dir_index = entry.get(DW_LNCT_directory_index, 0)
+                files.append(self._join(dirs[dir_index] if dir_index < len(dirs)
+                                        else '', entry.get(DW_LNCT_path, '??')))
+        else:
+            # In DWARF <= 4, directory 0 is the compilation directory and file
+            # indexes start at 1.
+            dirs = ['']
+            while data[pos]:
+                (name, pos) = _read_cstring_at(data, pos)
+                dirs.append(name)
+            pos += 1
+            files = ['??']
+            while data[pos]:
+                (name, pos) = _read_cstring_at(data, pos)
+                (dir_index, pos) = _read_uleb128(data, pos)
+                (_, pos) = _read_uleb128(data, pos)
+                (_, pos) = _read_uleb128(data, pos)
+                files.append(self._join(dirs[dir_index] if dir_index < len(dirs)
+                                        else '', name))
+            pos += 1
+
+        file_ids = [self._file_id(f) for f in files]
+
+        def new_sequence():
+            return (array('L'), array('l'), array('l'))
+
+        pos = program_start
+        address = 0
+        file = 1
+        line = 1
+        seq = new_sequence()
+        while pos < unit_end:
+            opcode = data[pos]
+            pos += 1
+            emit = False
+            if opcode >= opcode_base:
+                adjusted = opcode - opcode_base
+                address += (adjusted // line_range) * min_inst_length
+                line += line_base + adjusted % line_range
+                emit = True
+            elif opcode == 0:
+                (length, pos) = _read_uleb128(data, pos)
+                sub_opcode = data[pos]
+                if sub_opcode == 1:
+                    # DW_LNE_end_sequence
+                    seq[0].append(address)
+                    seq[1].append(-1)
+                    seq[2].append(0)
+                    sequences.append(seq)
+                    seq = new_sequence()
+                    address = 0
+                    file = 1
+                    line = 1
+                elif sub_opcode == 2:
+                    # DW_LNE_set_address
+                    address = self._unpack('Q' if address_size == 8 else 'I',
+                                           data, pos + 1)
+                elif sub_opcode == 3:
+                    # DW_LNE_define_file
+                    (name, _) = _read_cstring_at(data, pos + 1)
+                    file_ids.append(self._file_id(name))
+                pos += length
+            elif opcode == 1:
+                # DW_LNS_copy
+                emit = True
+            elif opcode == 2:
+                # DW_LNS_advance_pc
+                (advance, pos) = _read_uleb128(data, pos)
+                address += advance * min_inst_length
+            elif opcode == 3:
+                # DW_LNS_advance_line
+                (advance, pos) = _read_sleb128(data, pos)
+                line += advance
+            elif opcode == 4:
+                # DW_LNS_set_file
+                (file, pos) = _read_uleb128(data, pos)
+            elif opcode == 8:
+                # DW_LNS_const_add_pc
+                address += ((255 - opcode_base) // line_range) * min_inst_length
+            elif opcode == 9:
+                # DW_LNS_fixed_advance_pc
+                address += self._unpack('H', data, pos)
+                pos += 2
+            else:
+                # An opcode we don't care about; skip its operands.
+                for _ in range(standard_opcode_lengths[opcode - 1]):
+                    (_, pos) = _read_uleb128(data, pos)
+
+            if emit:
+                seq[0].append(address)
+                # A file register which doesn't name one of the unit's files
+                # means we don't know the line; lookup() treats -1 that way.
+                seq[1].append(file_ids[file] if file < len(file_ids) else -1)
+                seq[2].append(line)
+
+        return unit_end
+
+    def _read_v5_entries(self, data, pos, offset_size):
+        format_count = data[pos]
+        pos += 1
+        formats = []
+        for _ in range(format_count):
+            (content_type, pos) = _read_uleb128(data, pos)
+            (form, pos) = _read_uleb128(data, pos)
+            formats.append((content_type, form))
+
+        (count, pos) = _read_uleb128(data, pos)
+        entries = []
+        for _ in range(count):
+            entry = {}
+            for (content_type, form) in formats:
+                (value, pos) = self._read_form(data, pos, form, offset_size)
+                entry[content_type] = value
+            entries.append(entry)
+        return (entries, pos)
+
+    def _read_form(self, data, pos, form, offset_size):
+        if form == DW_FORM_string:
+            return _read_cstring_at(data, pos)
+        if form in (DW_FORM_line_strp, DW_FORM_strp):
+            (offset, pos) = self._read_offset(data, pos, offset_size)
+            strings = self._line_str if form == DW_FORM_line_strp else self._str
+            return (_read_cstring_at(strings, offset)[0], pos)
+        if form == DW_FORM_udata:
+            return _read_uleb128(data, pos)
+        if form == DW_FORM_data1:
+            return (data[pos], pos + 1)
+        if form == DW_FORM_data2:
+            return (self._unpack('H', data, pos), pos + 2)
+        if form == DW_FORM_data4:
+            return (self._unpack('I', data, pos), pos + 4)
+        if form == DW_FORM_data8:
+            return (self._unpack('Q', data, pos), pos + 8)
+        if form == DW_FORM_data16:
+            return (None, pos + 16)
+        if form == DW_FORM_block:
+            (length, pos) = _read_uleb128(data, pos)
+            return (None, pos + length)
+        if form == DW_FORM_block1:
+            return (None, pos + 1 + data[pos])
+        raise ValueError('Unsupported DWARF form 0x%x' % form)
+
+    @staticmethod
+    def _join(dir, name):
+        if not dir or name.startswith('/'):
+            return name
+        return dir.rstrip('/') + '/' + name
+
+
+class SymbolIndex(object):
+    """An address index over one ELF file's function symbols and line table.
+
+    lookup(address) returns a (func, file_name) tuple in the same form
+    addr2line -f prints them: func is '??' if we can't find a symbol, and
+    file_name is '??:0' if we can't find a line.  Function names are not
+    demangled.
+
+    """
+    def __init__(self, path):
+        with ElfFile(path) as elf:
+            symbols = sorted(elf.function_symbols())
+            self._lines = LineTable(elf)
+
+        self._addresses = array('L', (s[0] for s in symbols))
+        self._sizes = array('L', (s[1] for s in symbols))
+        self._names = [s[2] for s in symbols]
+
+    def lookup(self, address):
+        func = '??'
+        i = bisect_right(self._addresses, address) - 1
+        if i >= 0:
+            # Sized symbols have to actually contain the address; for unsized
+            # ones, we take the closest preceding symbol, unless it's the last
+            # one.
+            size = self._sizes[i]
+            if address < self._addresses[i] + size or \
+               (not size and i + 1 < len(self._addresses)):
+                func = self._names[i]
+        return (func, self._lines.lookup(address) or '??:0')
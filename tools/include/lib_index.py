@@ -0,0 +1,218 @@
+"""A persistent index of the libraries in a set of directory trees.
+
+Walking a full B2G tree to find a library takes tens of seconds, so instead we
+remember what we found last time, along with each directory's mtime.  When we
+refresh the index, we only list the directories whose mtime has changed;
+everything else we take from the saved index.  We also remember whether each
+library is stripped and what its build-id is, so we don't have to run nm over
+every copy of a library to find the unstripped one.
+
+Both fix_b2g_stack.py and scripts/profile-symbolicate.py use this module.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import hashlib
+import json
+import os
+import tempfile
+from collections import defaultdict
+
+from . import cache_utils
+from . import elf_utils
+
+
+class LibraryIndex(object):
+    """An index from basename to the paths of the files with that basename
+    under |roots|.
+
+    We only index files whose names end with one of |suffixes| or are one of
+    |names|, or, if |extensionless| is true, which have no extension at all
+    (e.g. executables like 'b2g'); if none of these are given, we index every
+    file.  We don't descend into directories named in |exclude_dirs|.
+
+    find(basename) returns the matching paths, in the order of |roots| (and
+    sorted within each root).  has_symbols(path) and build_id(path) return
+    information about a library in the index, which we compute the first time
+    someone asks for it and keep until the file changes.
+
+    Unless |persist| is false, we save the index in |cache_dir| (by default,
+    cache_utils.get_cache_dir()) when you call save(), and reuse it the next
+    time someone creates an index with the same arguments.
+
+    """
+
+    _version = 1
+
+    def __init__(self, roots, suffixes=None, names=None, extensionless=False,
+                 exclude_dirs=(), cache_dir=None, persist=True):
+        self._roots = [os.path.normpath(os.path.abspath(r)) for r in roots]
+        self._suffixes = tuple(suffixes) if suffixes is not None else None
+        self._names = frozenset(names) if names is not None else None
+        self._extensionless = extensionless
+        self._exclude_dirs = frozenset(exclude_dirs)
+        self._filename = None
+        if persist:
+            key = repr((self._version, self._roots, self._suffixes,
+                        sorted(self._names or []), self._extensionless,
+                        sorted(self._exclude_dirs)))
+            try:
+                self._filename = os.path.join(
+                    cache_dir or cache_utils.get_cache_dir(),
+                    'lib-index-%s.json' % hashlib.sha1(key.encode('utf-8')).hexdigest())
+            except OSError:
+                pass
+
+        self._dirs = {}
+        self._files = {}
+        self._dirty = False
+        self._load()
+        self._refresh()
+
+        self._by_name = defaultdict(list)
+        for root in self._roots:
+            self._add_dir_to_names(root)
+
+    def find(self, basename):
+        return self._by_name.get(basename, [])
+
+    def covers(self, basename):
+        """Check whether we index files named |basename|, i.e. whether an
+        empty find(basename) means there's no such file under our roots."""
+        return self._wants(basename)
+
+    def has_symbols(self, path):
+        """Check if the library at path is unstripped, i.e. if it has a
+        .symtab."""
+        return self._file_info(path)['has_symbols']
+
+    def build_id(self, path):
+        """Get the GNU build-id of the library at path, or None."""
+        return self._file_info(path)['build_id']
+
+    def save(self):
+        """Write the index out to disk, if it has changed."""
+        if not self._filename or not self._dirty:
+            return
+        data = {'dirs': self._dirs, 'files': self._files}
+        try:
+            # Write to a temporary file and rename it into place, so that
+            # concurrent readers never see a partially-written index.
+            (fd, tmp_path) = tempfile.mkstemp(
+                dir=os.path.dirname(self._filename), suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.rename(tmp_path, self._filename)
+            self._dirty = False
+        except (IOError, OSError):
+            pass
+
+    def _load(self):
+        if not self._filename:
+            return
+        try:
+            with open(self._filename, 'r') as f:
+                data = json.load(f)
+            self._dirs = data['dirs']
+            self._files = data['files']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            self._dirs = {}
+            self._files = {}
+
+    def _wants(self, name):
+        if self._suffixes is None and self._names is None and \
+           not self._extensionless:
+            return True
+        return (self._names is not None and name in self._names) or \
+               (self._suffixes is not None and name.endswith(self._suffixes)) or \
+               (self._extensionless and '.' not in name)
+
+    def _refresh(self):
+        """Bring self._dirs up to date with what's on disk.
+
+        We stat every directory we know about, but only list the ones whose
+        mtime has changed (or which we haven't seen before).
+
+        """
+        seen = set()
+        stack = list(reversed(self._roots))
+        while stack:
+            dir = stack.pop()
+            if dir in seen:
+                continue
+            seen.add(dir)
+            try:
+                mtime = os.stat(dir).st_mtime
+            except OSError:
+                continue
+
+            entry = self._dirs.get(dir)
+            if not entry or entry['mtime'] != mtime:
+                entry = self._list_dir(dir, mtime)
+                self._dirs[dir] = entry
+                self._dirty = True
+            stack.extend(os.path.join(dir, d) for d in reversed(entry['subdirs']))
+
+        # Forget about directories which no longer exist, or which are no
+        # longer under one of our roots.
+        for dir in list(self._dirs):
+            if dir not in seen:
+                del self._dirs[dir]
+                self._dirty = True
+        indexed = set(os.path.join(dir, f) for (dir, entry) in self._dirs.items()
+                      for f in entry['files'])
+        for path in list(self._files):
+            if path not in indexed:
+                del self._files[path]
+                self._dirty = True
+
+    def _list_dir(self, dir, mtime):
+        files = []
+        subdirs = []
+        try:
+            names = sorted(os.listdir(dir))
+        except OSError:
+            names = []
+        for name in names:
+            path = os.path.join(dir, name)
+            if os.path.isdir(path):
+                # Like os.walk, we don't follow symlinks to directories.
+                if name not in self._exclude_dirs and not os.path.islink(path):
+                    subdirs.append(name)
+            elif self._wants(name):
+                files.append(name)
+        return {'mtime': mtime, 'files': files, 'subdirs': subdirs}
+
+    def _add_dir_to_names(self, dir):
+        entry = self._dirs.get(dir)
+        if not entry:
+            return
+        for f in entry['files']:
+            self._by_name[f].append(os.path.join(dir, f))
+        for d in entry['subdirs']:
+            self._add_dir_to_names(os.path.join(dir, d))
+
+    def _file_info(self, path):
+        path = os.path.normpath(os.path.abspath(path))
+        try:
+            st = os.stat(path)
+            stat = [st.st_size, st.st_mtime]
+        except OSError:
+            stat = None
+
+        info = self._files.get(path)
+        if info and info['stat'] == stat:
+            return info
+
+        info = {'stat': stat, 'has_symbols': False, 'build_id': None}
+        try:
+            with elf_utils.ElfFile(path) as elf:
+                info['has_symbols'] = elf.has_symtab()
+                info['build_id'] = elf.build_id()
+        except (IOError, elf_utils.ElfError):
+            pass
+        self._files[path] = info
+        self._dirty = True
+        return info